@@ -18,6 +18,20 @@ except ImportError:
     logger.info("python-dotenv 未安装，跳过在 bot.py 顶层的 .env 加载。")
 # --- .ENV 早加载结束 ---
 
+# --- 日志配置 ---
+from plugins.logging_setup import configure_logging, sampled_logger
+
+# --- 生命周期管理 (优雅退出与异常退出恢复) ---
+from plugins.lifecycle import lifecycle
+
+# --- 优先级调度 (管理员 > 私聊 > 群@，按会话加权公平排队) ---
+
+# --- 本地知识库 (启动时在后台线程预热索引) ---
+from plugins.knowledge_base import knowledge_base
+
+# --- 流量录制 (QQBOT_RECORD_TRAFFIC=true 时开启，用于 tools/replay_traffic.py 回放) ---
+from plugins.traffic_recorder import traffic_recorder
+
 # --- 从 llm_api.py 导入 LLMInterface ---
 from plugins.llm_api import LLMInterface
 
@@ -90,6 +104,10 @@ def load_configurations() -> bool:
             "OPENAI_MAX_TOKENS": "OPENAI_MAX_TOKENS",
             "CLAUDE_MODEL": "CLAUDE_MODEL",
             "CLAUDE_MAX_TOKENS": "CLAUDE_MAX_TOKENS",
+            "QQBOT_ROUTER_ENABLED": "QQBOT_ROUTER_ENABLED",
+            "LLM_LIGHT_MODEL": "LLM_LIGHT_MODEL",
+            "LLM_LIGHT_MAX_TOKENS": "LLM_LIGHT_MAX_TOKENS",
+            "LLM_ROUTER_SIMPLE_MAX_CHARS": "LLM_ROUTER_SIMPLE_MAX_CHARS",
             "BT_UIN": "BT_UIN",
             "ROOT": "ROOT",
         }
@@ -143,151 +161,87 @@ def initialize_modules_status() -> Dict[str, bool]:
     return modules_status
 
 
-# --- NcatBot 事件回调 ---
-if NCATBOT_AVAILABLE and BotClient and GroupMessage and PrivateMessage and bot:
-    @bot.group_event()
-    async def my_group_message_handler(msg: GroupMessage):
-        logger.info(f"--- [NcatBot EVENT] Group message received ---")
-        logger.debug(f"GroupID={msg.group_id}, UserID={msg.user_id}, RawMessage='{msg.raw_message[:200]}'")
+# --- NcatBot 事件处理 ---
+# 处理逻辑定义为模块级函数，NcatBot 回调只负责转发；退出流程中不再接收新消息，并统计进行中的处理。
+async def handle_group_message(msg: GroupMessage):
+    """群消息处理：提取文本、判断是否@机器人，交给插件处理并回复"""
+    # 每条群消息 (包括未@机器人的) 都会经过这里，使用采样日志并把格式化推迟到确实需要输出时
+    sampled_logger.debug(
+        "--- [NcatBot EVENT] Group message received --- GroupID={}, UserID={}, RawMessage='{}'",
+        lambda: msg.group_id, lambda: msg.user_id, lambda: (msg.raw_message or "")[:200])
 
-        session_id = f"group_{msg.group_id}"
-        effective_text = ""
-        processed_prompt_for_llm = ""
+    session_id = f"group_{msg.group_id}"
+    effective_text = ""
+    processed_prompt_for_llm = ""
 
-        try:
-            if msg.text: effective_text = msg.text.strip()
-        except AttributeError:
-            logger.warning("GroupMessage no 'text' attr, cleaning raw_message.")
+    try:
+        if msg.text: effective_text = msg.text.strip()
+    except AttributeError:
+        logger.warning("GroupMessage no 'text' attr, cleaning raw_message.")
 
-        if not effective_text and msg.raw_message:
-            cleaned_message = re.sub(r"\[CQ:[^\]]+\]", "", msg.raw_message).strip()
-            effective_text = cleaned_message
+    if not effective_text and msg.raw_message:
+        cleaned_message = re.sub(r"\[CQ:[^\]]+\]", "", msg.raw_message).strip()
+        effective_text = cleaned_message
 
-        processed_prompt_for_llm = effective_text
+    processed_prompt_for_llm = effective_text
 
-        if effective_text == "测试":
-            try:
-                await msg.reply(text="NcatBot (群) 测试成功喵~ (来自bot.py)");
-                logger.info(f"回复群 {msg.group_id} 测试。")
-            except Exception as e:
-                logger.exception(f"回复群测试失败: {e}")
-            return
+    if effective_text == "测试":
+        try:
+            await msg.reply(text="NcatBot (群) 测试成功喵~ (来自bot.py)");
+            logger.info(f"回复群 {msg.group_id} 测试。")
+        except Exception as e:
+            logger.exception(f"回复群测试失败: {e}")
+        return
 
-        if effective_text.startswith('/'): return
+    if effective_text.startswith('/'): return
 
-        bot_qq_str = os.getenv("BT_UIN")
-        if not bot_qq_str:
-            logger.warning("BT_UIN未配置。")
-            return
-
-        is_at_me = False
-        try:
-            is_at_me = msg.is_at_me()
-            if is_at_me:
-                logger.info(f"Bot被@ (is_at_me). effective_text: '{effective_text}'")
-                if msg.text:
-                    processed_prompt_for_llm = msg.text.strip()
-                else:
-                    processed_prompt_for_llm = re.sub(rf"\[CQ:at,qq={bot_qq_str}\]", "", msg.raw_message, 1).strip()
-                    processed_prompt_for_llm = re.sub(r"\[CQ:[^\]]+\]", "", processed_prompt_for_llm).strip()
-        except AttributeError:
-            logger.warning(f"msg无is_at_me方法，回退CQ码检查@。")
-            cq_at_bot_tag = f"[CQ:at,qq={bot_qq_str}]"
-            if cq_at_bot_tag in msg.raw_message:
-                is_at_me = True
-                temp_cleaned = msg.raw_message.replace(cq_at_bot_tag, "", 1).strip()
-                processed_prompt_for_llm = re.sub(r"\[CQ:[^\]]+\]", "", temp_cleaned).strip()
-                logger.info(f"Bot被@ (CQ码检查). 清理后: '{processed_prompt_for_llm}'")
+    bot_qq_str = os.getenv("BT_UIN")
+    if not bot_qq_str:
+        logger.warning("BT_UIN未配置。")
+        return
 
+    is_at_me = False
+    try:
+        is_at_me = msg.is_at_me()
         if is_at_me:
-            final_prompt = processed_prompt_for_llm
-            logger.info(f"Bot被@, 最终Prompt for Plugin: '{final_prompt}' (session: {session_id})")
-
-            if not QQ_BOT_PLUGIN_AVAILABLE or not process_message_content:
-                logger.error(f"QQ Bot 核心插件未加载，无法处理群消息: {final_prompt}")
-                try:
-                    await msg.reply(text="抱歉，我的核心处理模块出了一点问题，暂时无法回复您。")
-                except Exception as e_reply:
-                    logger.exception(f"发送核心插件错误提示失败: {e_reply}")
-                return
-
-            if final_prompt:
-                raw_reply_from_plugin = await process_message_content(session_id, final_prompt)
-
-                response_to_send = ""
-                log_message_detail = ""
-
-                if raw_reply_from_plugin is None:
-                    logger.info(f"插件 (qq_bot.py) 未对 '{final_prompt}' 返回任何内容 (session: {session_id})。")
-                elif raw_reply_from_plugin == LLMInterface.SEARCH_NO_DATA_HINT:
-                    response_to_send = "抱歉，我尝试联网搜索并综合我的知识，但还是未能找到相关信息。这可能是因为信息不公开，或者查询条件过于具体。请尝试换个更宽泛的词再问我吧！"
-                    log_message_detail = "插件返回 SEARCH_NO_DATA_HINT"
-                elif raw_reply_from_plugin == LLMInterface.SENSITIVE_CONTENT_HINT:
-                    response_to_send = raw_reply_from_plugin
-                    log_message_detail = "插件返回 SENSITIVE_CONTENT_HINT"
-                elif raw_reply_from_plugin.startswith("AI服务") or \
-                        raw_reply_from_plugin.startswith("不支持的") or \
-                        raw_reply_from_plugin.startswith("抱歉，处理您的消息时出现了错误:") or \
-                        raw_reply_from_plugin.startswith("抱歉，处理您的消息时内部出现了错误:"):  # 覆盖插件返回的两种错误前缀
-                    response_to_send = raw_reply_from_plugin
-                    log_message_detail = f"插件返回错误或API服务消息: '{raw_reply_from_plugin}'"
-                else:
-                    response_to_send = raw_reply_from_plugin
-                    log_message_detail = f"插件返回内容: '{response_to_send[:50]}...'"
-
-                if response_to_send:
-                    try:
-                        reply_elements = [At(msg.user_id), Text(" " + str(response_to_send))] if At and Text else []
-                        if MessageChain and reply_elements:
-                            await msg.reply(rtf=MessageChain(reply_elements))
-                        else:
-                            await msg.reply(text=f"@{msg.user_id} {str(response_to_send)}")
-                        logger.info(f"{log_message_detail} (已回复群@, session {session_id})")
-                    except Exception as e:
-                        logger.exception(f"通过插件发送回复或提示失败: {e}")
+            logger.info(f"Bot被@ (is_at_me). effective_text: '{effective_text}'")
+            if msg.text:
+                processed_prompt_for_llm = msg.text.strip()
             else:
-                try:
-                    await msg.reply(text="喵？艾特我有什么事吗？");
-                    logger.info(f"回复群 {msg.group_id} 空@。")
-                except Exception as e:
-                    logger.exception(f"回复空@失败: {e}")
-
-
-    @bot.private_event()
-    async def my_private_message_handler(msg: PrivateMessage):
-        logger.info(f"--- [NcatBot EVENT] Private message received ---")
-        logger.debug(f"UserID={msg.user_id}, RawMessage='{msg.raw_message[:200]}'")
-
-        session_id = f"private_{msg.user_id}"
-        effective_text = msg.raw_message.strip() if msg.raw_message else ""
-
-        if effective_text == "测试":
-            try:
-                await bot.api.post_private_msg(user_id=msg.user_id, text="NcatBot (私聊) 测试成功喵~ (来自bot.py)");
-                logger.info(f"回复用户 {msg.user_id} 私聊测试。")
-            except Exception as e:
-                logger.exception(f"回复私聊测试失败: {e}")
-            return
-
-        if effective_text.startswith('/'): return
+                processed_prompt_for_llm = re.sub(rf"\[CQ:at,qq={bot_qq_str}\]", "", msg.raw_message, 1).strip()
+                processed_prompt_for_llm = re.sub(r"\[CQ:[^\]]+\]", "", processed_prompt_for_llm).strip()
+    except AttributeError:
+        logger.warning(f"msg无is_at_me方法，回退CQ码检查@。")
+        cq_at_bot_tag = f"[CQ:at,qq={bot_qq_str}]"
+        if cq_at_bot_tag in msg.raw_message:
+            is_at_me = True
+            temp_cleaned = msg.raw_message.replace(cq_at_bot_tag, "", 1).strip()
+            processed_prompt_for_llm = re.sub(r"\[CQ:[^\]]+\]", "", temp_cleaned).strip()
+            logger.info(f"Bot被@ (CQ码检查). 清理后: '{processed_prompt_for_llm}'")
+
+    traffic_recorder.record_message("group", msg.group_id, msg.user_id,
+                                    processed_prompt_for_llm if is_at_me else effective_text, at_me=is_at_me)
+
+    if is_at_me:
+        final_prompt = processed_prompt_for_llm
+        logger.info(f"Bot被@, 最终Prompt for Plugin: '{final_prompt}' (session: {session_id})")
 
         if not QQ_BOT_PLUGIN_AVAILABLE or not process_message_content:
-            logger.error(f"QQ Bot 核心插件未加载，无法处理私聊消息: {effective_text}")
+            logger.error(f"QQ Bot 核心插件未加载，无法处理群消息: {final_prompt}")
             try:
-                await bot.api.post_private_msg(user_id=msg.user_id,
-                                               text="抱歉，我的核心处理模块出了一点问题，暂时无法回复您。")
+                await msg.reply(text="抱歉，我的核心处理模块出了一点问题，暂时无法回复您。")
             except Exception as e_reply:
                 logger.exception(f"发送核心插件错误提示失败: {e_reply}")
             return
 
-        if effective_text:
-            raw_reply_from_plugin = await process_message_content(session_id, effective_text)
+        if final_prompt:
+            raw_reply_from_plugin = await process_message_content(session_id, final_prompt, str(msg.user_id))
 
             response_to_send = ""
             log_message_detail = ""
 
             if raw_reply_from_plugin is None:
-                logger.info(f"插件 (qq_bot.py) 未对 '{effective_text}' 返回任何内容 (session: {session_id})。")
+                logger.info(f"插件 (qq_bot.py) 未对 '{final_prompt}' 返回任何内容 (session: {session_id})。")
             elif raw_reply_from_plugin == LLMInterface.SEARCH_NO_DATA_HINT:
                 response_to_send = "抱歉，我尝试联网搜索并综合我的知识，但还是未能找到相关信息。这可能是因为信息不公开，或者查询条件过于具体。请尝试换个更宽泛的词再问我吧！"
                 log_message_detail = "插件返回 SEARCH_NO_DATA_HINT"
@@ -297,7 +251,7 @@ if NCATBOT_AVAILABLE and BotClient and GroupMessage and PrivateMessage and bot:
             elif raw_reply_from_plugin.startswith("AI服务") or \
                     raw_reply_from_plugin.startswith("不支持的") or \
                     raw_reply_from_plugin.startswith("抱歉，处理您的消息时出现了错误:") or \
-                    raw_reply_from_plugin.startswith("抱歉，处理您的消息时内部出现了错误:"):
+                    raw_reply_from_plugin.startswith("抱歉，处理您的消息时内部出现了错误:"):  # 覆盖插件返回的两种错误前缀
                 response_to_send = raw_reply_from_plugin
                 log_message_detail = f"插件返回错误或API服务消息: '{raw_reply_from_plugin}'"
             else:
@@ -306,28 +260,110 @@ if NCATBOT_AVAILABLE and BotClient and GroupMessage and PrivateMessage and bot:
 
             if response_to_send:
                 try:
-                    logger.debug(
-                        f"准备发送私聊回复给 {msg.user_id} (session {session_id}). 内容: '{str(response_to_send)[:100]}...'")
-                    await bot.api.post_private_msg(user_id=msg.user_id, text=str(response_to_send))
-                    logger.info(f"{log_message_detail} (已回复私聊, session {session_id})")
+                    reply_elements = [At(msg.user_id), Text(" " + str(response_to_send))] if At and Text else []
+                    if MessageChain and reply_elements:
+                        await msg.reply(rtf=MessageChain(reply_elements))
+                    else:
+                        await msg.reply(text=f"@{msg.user_id} {str(response_to_send)}")
+                    logger.info(f"{log_message_detail} (已回复群@, session {session_id})")
                 except Exception as e:
-                    logger.exception(f"通过插件发送私聊回复或提示失败: {e}")
-        elif msg.raw_message and not effective_text:
-            logger.info(f"收到用户 {msg.user_id} 非文本私聊，未处理。")
+                    logger.exception(f"通过插件发送回复或提示失败: {e}")
+        else:
+            try:
+                await msg.reply(text="喵？艾特我有什么事吗？");
+                logger.info(f"回复群 {msg.group_id} 空@。")
+            except Exception as e:
+                logger.exception(f"回复空@失败: {e}")
+
+
+async def handle_private_message(msg: PrivateMessage):
+    """私聊消息处理：交给插件处理并回复"""
+    sampled_logger.debug(
+        "--- [NcatBot EVENT] Private message received --- UserID={}, RawMessage='{}'",
+        lambda: msg.user_id, lambda: (msg.raw_message or "")[:200])
+
+    session_id = f"private_{msg.user_id}"
+    effective_text = msg.raw_message.strip() if msg.raw_message else ""
+
+    if effective_text == "测试":
+        try:
+            await bot.api.post_private_msg(user_id=msg.user_id, text="NcatBot (私聊) 测试成功喵~ (来自bot.py)");
+            logger.info(f"回复用户 {msg.user_id} 私聊测试。")
+        except Exception as e:
+            logger.exception(f"回复私聊测试失败: {e}")
+        return
+
+    if effective_text.startswith('/'): return
+
+    traffic_recorder.record_message("private", msg.user_id, msg.user_id, effective_text)
+
+    if not QQ_BOT_PLUGIN_AVAILABLE or not process_message_content:
+        logger.error(f"QQ Bot 核心插件未加载，无法处理私聊消息: {effective_text}")
+        try:
+            await bot.api.post_private_msg(user_id=msg.user_id,
+                                           text="抱歉，我的核心处理模块出了一点问题，暂时无法回复您。")
+        except Exception as e_reply:
+            logger.exception(f"发送核心插件错误提示失败: {e_reply}")
+        return
+
+    if effective_text:
+        raw_reply_from_plugin = await process_message_content(session_id, effective_text, str(msg.user_id))
+
+        response_to_send = ""
+        log_message_detail = ""
+
+        if raw_reply_from_plugin is None:
+            logger.info(f"插件 (qq_bot.py) 未对 '{effective_text}' 返回任何内容 (session: {session_id})。")
+        elif raw_reply_from_plugin == LLMInterface.SEARCH_NO_DATA_HINT:
+            response_to_send = "抱歉，我尝试联网搜索并综合我的知识，但还是未能找到相关信息。这可能是因为信息不公开，或者查询条件过于具体。请尝试换个更宽泛的词再问我吧！"
+            log_message_detail = "插件返回 SEARCH_NO_DATA_HINT"
+        elif raw_reply_from_plugin == LLMInterface.SENSITIVE_CONTENT_HINT:
+            response_to_send = raw_reply_from_plugin
+            log_message_detail = "插件返回 SENSITIVE_CONTENT_HINT"
+        elif raw_reply_from_plugin.startswith("AI服务") or \
+                raw_reply_from_plugin.startswith("不支持的") or \
+                raw_reply_from_plugin.startswith("抱歉，处理您的消息时出现了错误:") or \
+                raw_reply_from_plugin.startswith("抱歉，处理您的消息时内部出现了错误:"):
+            response_to_send = raw_reply_from_plugin
+            log_message_detail = f"插件返回错误或API服务消息: '{raw_reply_from_plugin}'"
+        else:
+            response_to_send = raw_reply_from_plugin
+            log_message_detail = f"插件返回内容: '{response_to_send[:50]}...'"
+
+        if response_to_send:
+            try:
+                logger.debug(
+                    f"准备发送私聊回复给 {msg.user_id} (session {session_id}). 内容: '{str(response_to_send)[:100]}...'")
+                await bot.api.post_private_msg(user_id=msg.user_id, text=str(response_to_send))
+                logger.info(f"{log_message_detail} (已回复私聊, session {session_id})")
+            except Exception as e:
+                logger.exception(f"通过插件发送私聊回复或提示失败: {e}")
+    elif msg.raw_message and not effective_text:
+        logger.info(f"收到用户 {msg.user_id} 非文本私聊，未处理。")
+
+
+if NCATBOT_AVAILABLE and BotClient and GroupMessage and PrivateMessage and bot:
+    @bot.group_event()
+    async def my_group_message_handler(msg: GroupMessage):
+        if not lifecycle.accepting:
+            return
+        async with lifecycle.track():
+            await handle_group_message(msg)
+
+
+    @bot.private_event()
+    async def my_private_message_handler(msg: PrivateMessage):
+        if not lifecycle.accepting:
+            return
+        async with lifecycle.track():
+            await handle_private_message(msg)
 else:
     logger.error("NcatBot 未加载或核心插件存在问题，无法注册事件处理。")
 
 # --- 主程序入口 ---
 if __name__ == "__main__":
-    logger.remove()
-    logger.add(sys.stderr, level="DEBUG")
-    log_file_path = os.path.join(LOGS_DIR, "bot_{time}.log")
-    try:
-        logger.add(log_file_path, rotation="20 MB", level="DEBUG", compression="zip", encoding="utf-8", backtrace=True,
-                   diagnose=True)
-    except Exception as e:
-        sys.stderr.write(f"CRITICAL: 添加文件日志失败: {e}\n")
-    logger.info(f"--- 应用启动 ({os.path.basename(__file__)}) ---")
+    log_mode = configure_logging(LOGS_DIR)
+    logger.info(f"--- 应用启动 ({os.path.basename(__file__)}) --- 日志模式: {log_mode}")
 
     if not load_configurations():  # .env 应该在顶层已加载，这里主要是config.py和后续处理
         logger.warning("自定义配置加载可能不完整或失败（主要指config.py部分）。")
@@ -363,6 +399,11 @@ if __name__ == "__main__":
         logger.critical("BT_UIN 未设置，程序退出。")
         sys.exit(1)
 
+    # qq_bot.py 导入时已注册会话、统计数据的落盘与恢复操作
+    lifecycle.startup()
+    lifecycle.install_signal_handlers()
+    knowledge_base.preload_in_background()
+
     try:
         logger.info(f"准备使用QQ号 {bot_uin_to_run} 启动 NcatBot...");
         bot.run(bt_uin=str(bot_uin_to_run));
@@ -372,4 +413,6 @@ if __name__ == "__main__":
     except Exception as e:
         logger.exception("运行 NcatBot 时发生严重错误。")
     finally:
-        logger.info(f"--- 应用结束 ---")
\ No newline at end of file
+        lifecycle.finalize()  # 未经 SIGTERM 流程退出 (如 Ctrl+C 或异常) 时，在这里落盘数据
+        logger.info(f"--- 应用结束 ---")
+        logger.remove()  # async 日志模式下等待后台写入线程写完队列中的日志
\ No newline at end of file
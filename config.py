@@ -37,6 +37,16 @@ CLAUDE_MODEL = "claude-3-sonnet-20240229"
 # CLAUDE_TEMPERATURE = 0.7
 # CLAUDE_MAX_TOKENS = 2000
 
+# -----------------------------------------------------------------------------
+#  查询分级路由 (plugins/query_router.py)
+# -----------------------------------------------------------------------------
+# 在调用大模型之前用本地规则判断消息复杂度：问候、寒暄等简单短消息走 "light" 档，
+# 使用更便宜的模型、更小的 max_tokens 且不联网搜索；其余消息走 "full" 档，沿用上面的默认配置。
+QQBOT_ROUTER_ENABLED = True
+LLM_LIGHT_MODEL = ""  # light 档使用的模型 (必须属于当前 LLM_PROVIDER，例如智谱可填 "glm-4-flash-250414")，留空则与默认模型相同
+LLM_LIGHT_MAX_TOKENS = 512  # light 档的最大token数
+LLM_ROUTER_SIMPLE_MAX_CHARS = 20  # 不超过此长度且无复杂特征的消息视为简单消息
+
 # -----------------------------------------------------------------------------
 #  NcatBot 相关配置
 # -----------------------------------------------------------------------------
@@ -0,0 +1,392 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from loguru import logger
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from .lifecycle import lifecycle
+from .scheduler import scheduler
+
+# --- 聊天历史索引、归档与导出 ---
+# chat_history/index.json 记录每个会话文件的最后写入时间与消息数，以及已归档会话所在的归档包，
+# 启动加载与后台维护都按索引进行，不再遍历目录。
+# 后台维护任务在事件循环中低优先级运行 (有消息正在处理或排队时让路)：
+#   1. 超过 QQBOT_HISTORY_ARCHIVE_DAYS 天未活跃的会话移入 chat_history/archive/ 下按月的 gzip 归档包，并从内存中卸载；
+#   2. 磁盘上超过 QQBOT_HISTORY_MAX_MESSAGES_ON_DISK 条消息的会话文件被截断 (保留系统提示与最近的消息)。
+# 归档后再次收到该会话的消息会开始新的会话，旧内容保留在归档包中，可通过导出获取。
+
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+ARCHIVE_DIRNAME = "archive"
+
+try:
+    HISTORY_ARCHIVE_DAYS = float(os.getenv("QQBOT_HISTORY_ARCHIVE_DAYS", "30"))
+except ValueError:
+    HISTORY_ARCHIVE_DAYS = 30.0
+try:
+    HISTORY_RETENTION_INTERVAL = float(os.getenv("QQBOT_HISTORY_RETENTION_INTERVAL", "3600"))
+except ValueError:
+    HISTORY_RETENTION_INTERVAL = 3600.0
+
+# 每批处理的会话数、批次之间的停顿 (秒)，以及调度队列有积压时最多让路多久
+RETENTION_BATCH_SIZE = 20
+RETENTION_BATCH_PAUSE = 0.5
+RETENTION_MAX_DEFER_SECONDS = 60
+RETENTION_FIRST_RUN_DELAY = 60
+
+
+class SessionStore(dict):
+    """
+    内存中的会话字典 (会话ID -> 消息列表)，同时维护全部会话的消息总数，诊断时不必遍历所有会话。
+    整体替换 (赋值/删除/pop) 会自动更新计数；向已有会话追加消息需通过 append_message。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.message_count = 0
+
+    def __setitem__(self, user_id: str, session: List[Dict[str, str]]) -> None:
+        previous = dict.get(self, user_id)
+        self.message_count += len(session) - (len(previous) if previous is not None else 0)
+        super().__setitem__(user_id, session)
+
+    def __delitem__(self, user_id: str) -> None:
+        self.message_count -= len(self[user_id])
+        super().__delitem__(user_id)
+
+    def pop(self, user_id: str, *default):
+        if user_id in self:
+            self.message_count -= len(self[user_id])
+        return super().pop(user_id, *default)
+
+    def append_message(self, user_id: str, message: Dict[str, str]) -> None:
+        self[user_id].append(message)
+        self.message_count += 1
+
+
+class SessionIndex:
+    """会话索引。可能在写回缓存的后台线程中更新，所有修改都加锁。"""
+
+    def __init__(self, history_dir: str):
+        self.history_dir = history_dir
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.archived: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.history_dir, INDEX_FILENAME)
+
+    def load(self) -> bool:
+        """读取索引文件，返回是否成功 (不存在或损坏时需要调用方扫描目录重建)"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                logger.warning(f"[history] 会话索引版本 {data.get('version')} 与当前版本 {INDEX_VERSION} 不一致，将重建。")
+                return False
+            with self._lock:
+                self.sessions = data.get("sessions", {})
+                self.archived = data.get("archived", {})
+                self._dirty = False
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"[history] 读取会话索引 {self.path} 失败，将重建: {e}")
+            return False
+
+    def rebuild(self) -> List[str]:
+        """扫描目录重建活跃会话部分 (归档记录保留)，返回所有会话 ID。只在索引缺失或异常退出后调用。"""
+        sessions: Dict[str, Dict[str, Any]] = {}
+        if os.path.isdir(self.history_dir):
+            for filename in os.listdir(self.history_dir):
+                if filename.endswith(".json") and filename != INDEX_FILENAME:
+                    user_id = filename[:-5]
+                    try:
+                        mtime = os.path.getmtime(os.path.join(self.history_dir, filename))
+                    except OSError:
+                        continue
+                    previous = self.sessions.get(user_id, {})
+                    sessions[user_id] = {"updated_at": mtime, "messages": previous.get("messages", 0)}
+        with self._lock:
+            self.sessions = sessions
+            self._dirty = True
+        logger.info(f"[history] 已扫描 {self.history_dir} 重建会话索引: {len(sessions)} 个会话。")
+        return list(sessions)
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            return list(self.sessions)
+
+    def entries(self) -> List[Any]:
+        with self._lock:
+            return list(self.sessions.items())
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.sessions.get(user_id)
+            return dict(entry) if entry is not None else None
+
+    def touch(self, user_id: str, messages: int, updated_at: Optional[float] = None) -> None:
+        with self._lock:
+            self.sessions[user_id] = {"updated_at": updated_at or time.time(), "messages": messages}
+            self._dirty = True
+
+    def forget(self, user_id: str) -> None:
+        with self._lock:
+            if self.sessions.pop(user_id, None) is not None:
+                self._dirty = True
+
+    def mark_archived(self, user_id: str, bundle: str, last_active: float) -> None:
+        """记录归档；归档期间该会话已开始新的对话 (索引时间晚于 last_active) 时保留其活跃记录"""
+        with self._lock:
+            entry = self.sessions.get(user_id)
+            if entry is not None and entry.get("updated_at", 0) <= last_active:
+                del self.sessions[user_id]
+            self.archived[user_id] = {"bundle": bundle, "archived_at": time.time(), "last_active": last_active}
+            self._dirty = True
+
+    def save(self) -> bool:
+        """索引有变化时原子地写回文件，返回是否写入"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            payload = {"version": INDEX_VERSION, "sessions": dict(self.sessions), "archived": dict(self.archived)}
+            self._dirty = False
+        try:
+            os.makedirs(self.history_dir, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"[history] 保存会话索引 {self.path} 失败: {e}")
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self.sessions), "archived": len(self.archived)}
+
+
+def _archive_bundle_name(timestamp: float) -> str:
+    return f"{ARCHIVE_DIRNAME}/chat_history-{time.strftime('%Y-%m', time.localtime(timestamp))}.jsonl.gz"
+
+
+def archive_session_file(history_dir: str, user_id: str, last_active: float) -> Optional[str]:
+    """
+    把会话文件追加到当月归档包 (每次追加为一个 gzip 成员) 后删除原文件，返回归档包相对路径。
+    先写归档再删文件：中途崩溃最多导致该会话在归档包中重复一份，不会丢失。
+    """
+    file_path = os.path.join(history_dir, f"{user_id}.json")
+    try:
+        mtime_ns = os.stat(file_path).st_mtime_ns
+        with open(file_path, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+    except FileNotFoundError:
+        return None
+    bundle = _archive_bundle_name(time.time())
+    record = {"session_id": user_id, "last_active": last_active, "archived_at": time.time(), "messages": messages}
+    os.makedirs(os.path.join(history_dir, ARCHIVE_DIRNAME), exist_ok=True)
+    with gzip.open(os.path.join(history_dir, bundle), "ab") as f:
+        f.write((json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+    try:
+        # 归档期间该会话开始了新的对话并写入了新文件 (原子替换会改变 mtime)，保留新文件
+        if os.stat(file_path).st_mtime_ns == mtime_ns:
+            os.remove(file_path)
+        else:
+            logger.info(f"[history] 会话 {user_id} 在归档期间有新消息写入，保留新的会话文件。")
+    except FileNotFoundError:
+        pass
+    return bundle
+
+
+def iter_sessions(history_dir: str, include_archived: bool = True, since: Optional[float] = None,
+                  prefix: str = "") -> Iterator[Dict[str, Any]]:
+    """
+    逐个产出会话 {"session_id", "last_active", "archived", "messages"}，一次只在内存中保留一个会话，
+    供批量导出使用。活跃会话按索引文件读取 (索引不存在时退化为扫描目录)，归档包按行流式解压。
+    """
+    index = SessionIndex(history_dir)
+    if not index.load():
+        index.rebuild()
+    for user_id, entry in sorted(index.sessions.items()):
+        if not user_id.startswith(prefix) or (since and entry.get("updated_at", 0) < since):
+            continue
+        try:
+            with open(os.path.join(history_dir, f"{user_id}.json"), "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"[history] 导出时读取会话 {user_id} 失败，跳过: {e}")
+            continue
+        yield {"session_id": user_id, "last_active": entry.get("updated_at", 0), "archived": False,
+               "messages": messages}
+    if not include_archived:
+        return
+    # 归档包按月生成、数量很少，直接列出归档目录，即使索引丢失也不会漏导
+    archive_dir = os.path.join(history_dir, ARCHIVE_DIRNAME)
+    bundles = sorted(f"{ARCHIVE_DIRNAME}/{name}" for name in os.listdir(archive_dir)
+                     if name.endswith(".jsonl.gz")) if os.path.isdir(archive_dir) else []
+    for bundle in bundles:
+        try:
+            with gzip.open(os.path.join(history_dir, bundle), "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if not record["session_id"].startswith(prefix):
+                        continue
+                    if since and record.get("last_active", 0) < since:
+                        continue
+                    record["archived"] = True
+                    yield record
+        except (OSError, EOFError, json.JSONDecodeError) as e:
+            logger.warning(f"[history] 导出时读取归档包 {bundle} 出错，已跳过剩余内容: {e}")
+
+
+def export_sessions(history_dir: str, output_path: str, include_archived: bool = True,
+                    since: Optional[float] = None, prefix: str = "") -> int:
+    """把会话流式导出为 JSON Lines (.gz 结尾时压缩)，返回导出的会话数"""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    opener = gzip.open if output_path.endswith(".gz") else open
+    count = 0
+    tmp_path = output_path + ".tmp"
+    with opener(tmp_path, "wt", encoding="utf-8") as f:
+        for record in iter_sessions(history_dir, include_archived, since, prefix):
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+    os.replace(tmp_path, output_path)
+    return count
+
+
+class HistoryRetentionService:
+    """
+    后台维护任务。会话字典与脏会话集合只在事件循环线程中修改，文件读写放到线程池中执行。
+    由 qq_bot 在第一次处理消息时启动 (此时事件循环已在运行)，退出时由 lifecycle 停止。
+    """
+
+    def __init__(self, index: SessionIndex, sessions: Dict[str, List[Dict[str, str]]], dirty: Set[str],
+                 active: Dict[str, int], write_session: Callable[[str, List[Dict[str, str]]], None],
+                 max_messages_on_disk: int, archive_days: float = HISTORY_ARCHIVE_DAYS,
+                 interval: float = HISTORY_RETENTION_INTERVAL):
+        self.index = index
+        self.sessions = sessions
+        self.dirty = dirty
+        self.active = active  # 正在处理消息的会话，不归档、不卸载
+        self.write_session = write_session
+        self.max_messages_on_disk = max_messages_on_disk
+        self.archive_days = archive_days
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Dict[str, Any] = {}
+
+    def ensure_started(self) -> None:
+        if self._task is not None or self.interval <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run_forever())
+        logger.info(f"[history] 后台维护任务已启动 (每 {self.interval:.0f} 秒一次，归档 {self.archive_days:g} 天未活跃的会话)。")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self) -> None:
+        await asyncio.sleep(RETENTION_FIRST_RUN_DELAY)
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"[history] 后台维护出错: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _busy(self) -> bool:
+        """
+        是否有线上流量：正在退出、处理器中有进行中的消息、有会话正在处理，或调度队列中有排队的消息。
+        调度默认关闭 (不排队)，因此主要依据进行中的处理数判断。
+        """
+        return (not lifecycle.accepting or lifecycle.in_flight > 0 or bool(self.active)
+                or any(scheduler.queue_depths().values()))
+
+    async def _yield_to_traffic(self) -> None:
+        """低优先级：有消息正在处理或排队时先让路，最多等待 RETENTION_MAX_DEFER_SECONDS 秒"""
+        waited = 0.0
+        while self._busy() and waited < RETENTION_MAX_DEFER_SECONDS:
+            await asyncio.sleep(1)
+            waited += 1
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+    async def run_once(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        archived = trimmed = 0
+        now = time.time()
+        entries = self.index.entries()
+
+        if self.archive_days > 0:
+            cutoff = now - self.archive_days * 86400
+            idle = [uid for uid, e in entries if e.get("updated_at", 0) < cutoff and uid not in self.dirty]
+            for start in range(0, len(idle), RETENTION_BATCH_SIZE):
+                await self._yield_to_traffic()
+                for user_id in idle[start:start + RETENTION_BATCH_SIZE]:
+                    # 让路期间可能收到了新消息：归档前重新读取索引，并跳过正在处理或待落盘的会话
+                    entry = self.index.get(user_id)
+                    if entry is None or entry.get("updated_at", 0) >= cutoff:
+                        continue
+                    if user_id in self.active or user_id in self.dirty:
+                        continue
+                    last_active = entry.get("updated_at", 0)
+                    # 先从内存卸载，之后再收到的消息会开始新会话 (归档只删除未被改写过的旧文件)
+                    self.sessions.pop(user_id, None)
+                    try:
+                        bundle = await loop.run_in_executor(None, archive_session_file, self.index.history_dir,
+                                                            user_id, last_active)
+                    except Exception as e:
+                        logger.error(f"[history] 归档会话 {user_id} 失败: {e}")
+                        continue
+                    if bundle is None:
+                        if user_id not in self.sessions:
+                            self.index.forget(user_id)
+                    else:
+                        self.index.mark_archived(user_id, bundle, last_active)
+                        archived += 1
+
+        if self.max_messages_on_disk > 0:
+            oversized = [uid for uid, e in entries
+                         if e.get("messages", 0) > self.max_messages_on_disk + 1 and uid in self.sessions]
+            for start in range(0, len(oversized), RETENTION_BATCH_SIZE):
+                await self._yield_to_traffic()
+                for user_id in oversized[start:start + RETENTION_BATCH_SIZE]:
+                    session = self.sessions.get(user_id)
+                    if not session or len(session) <= self.max_messages_on_disk + 1:
+                        continue
+                    # 整体替换而不是原地切片，SessionStore 才能同步更新消息总数
+                    session = [session[0]] + session[-self.max_messages_on_disk:]
+                    self.sessions[user_id] = session
+                    await loop.run_in_executor(None, self.write_session, user_id, list(session))
+                    trimmed += 1
+
+        await loop.run_in_executor(None, self.index.save)
+        self.last_run = {"finished_at": time.time(), "archived": archived, "trimmed": trimmed,
+                         "seconds": round(time.monotonic() - started_at, 2)}
+        if archived or trimmed:
+            logger.info(f"[history] 后台维护完成: 归档 {archived} 个会话，截断 {trimmed} 个会话文件，"
+                        f"耗时 {self.last_run['seconds']} 秒。")
+        return self.last_run
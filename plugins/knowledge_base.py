@@ -0,0 +1,335 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from loguru import logger
+from typing import List, Dict, Any, Optional, Tuple
+
+# --- 本地知识库 (FAQ) ---
+# 管理员提供的问答与文档建立进程内的 BM25 倒排索引 (中文按字二元组切分，英文/数字按词切分)，
+# 在调用大模型之前检索：高置信度的 FAQ 命中直接回答，中等置信度的命中作为精简参考资料注入上下文。
+# 项目中没有可用的本地向量模型，因此使用纯词法检索；索引支持按条目/按文件增量更新。
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(PROJECT_ROOT_DIR, "data")
+# QQBOT_KB_DIR 可把知识库放到其他目录 (tools/replay_traffic.py 用它把回放中的知识库命令隔离在临时目录中)
+KB_DIR = os.getenv("QQBOT_KB_DIR") or os.path.join(DATA_DIR, "knowledge_base")
+KB_DOC_SUFFIXES = (".txt", ".md")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+DOC_CHUNK_MAX_CHARS = 300
+CONTEXT_MAX_CHARS = 600
+
+_ASCII_WORD = re.compile(r"[a-z0-9]+")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+# 疑问句式中的高频二元组，几乎不携带主题信息，建索引和检索时都忽略
+_STOP_TOKENS = frozenset((
+    "什么", "么时", "时候", "怎么", "么样", "哪里", "在哪", "是什", "为什", "么是", "可以", "一下", "请问",
+    "是不", "不是", "有没", "没有", "的", "了", "吗", "呢", "啊", "吧",
+))
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def tokenize(text: str) -> List[str]:
+    """英文/数字按词切分，连续汉字按二元组切分 (单个汉字保留为一元组)，并去掉疑问句式中的停用词"""
+    text = text.lower()
+    tokens = _ASCII_WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return [t for t in tokens if t not in _STOP_TOKENS]
+
+
+def _chunk_document(text: str) -> List[str]:
+    """按空行分段，过长的段落按长度切开，得到用于检索的片段"""
+    chunks: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > DOC_CHUNK_MAX_CHARS:
+            chunks.append(paragraph[:DOC_CHUNK_MAX_CHARS])
+            paragraph = paragraph[DOC_CHUNK_MAX_CHARS:]
+        if paragraph:
+            chunks.append(paragraph)
+    return chunks
+
+
+class BM25Index:
+    """支持增量添加/删除文档的 BM25 倒排索引"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {doc_id: tf}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def term_frequencies(text: str) -> Tuple[Dict[str, int], int]:
+        """切词并统计词频，返回 (词频, 文档长度)。不修改索引，可以在锁外预先计算"""
+        tokens = tokenize(text)
+        tf: Dict[str, int] = {}
+        for token in tokens:
+            tf[token] = tf.get(token, 0) + 1
+        return tf, len(tokens)
+
+    def add(self, doc_id: str, text: str) -> None:
+        self.add_terms(doc_id, *self.term_frequencies(text))
+
+    def add_terms(self, doc_id: str, tf: Dict[str, int], length: int) -> None:
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        self.doc_terms[doc_id] = tf
+        self.doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: str) -> None:
+        tf = self.doc_terms.pop(doc_id, None)
+        if tf is None:
+            return
+        for term in tf:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self._total_length -= self.doc_lengths.pop(doc_id, 0)
+
+    def idf(self, term: str) -> float:
+        n = len(self.doc_lengths)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, limit: int = 3) -> List[Tuple[str, float, float, float]]:
+        """
+        返回 [(doc_id, bm25分数, 查询覆盖率, 文档覆盖率)]。
+        覆盖率为双方共有词的 IDF 之和占各自全部词 IDF 之和的比例，用作 0~1 的置信度。
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.doc_lengths:
+            return []
+        avg_length = self._total_length / len(self.doc_lengths) or 1.0
+        idf = {term: self.idf(term) for term in query_terms}
+        scores: Dict[str, float] = {}
+        for term in query_terms:
+            for doc_id, tf in self.postings.get(term, {}).items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * tf * (BM25_K1 + 1) / norm
+        query_mass = sum(idf.values()) or 1.0
+        results = []
+        for doc_id, score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]:
+            doc_terms = self.doc_terms[doc_id]
+            shared = query_terms.intersection(doc_terms)
+            shared_mass = sum(idf[t] for t in shared)
+            doc_mass = sum(self.idf(t) for t in doc_terms) or 1.0
+            results.append((doc_id, score, shared_mass / query_mass, shared_mass / doc_mass))
+        return results
+
+
+class KnowledgeBase:
+    """
+    FAQ 条目保存在 data/knowledge_base/faq.json，文档放在 data/knowledge_base/docs/ (.txt/.md)。
+    FAQ 以问题文本建立索引，可直接作为回答；文档按段落切片建立索引，只作为参考资料注入。
+    """
+
+    def __init__(self, kb_dir: str = KB_DIR):
+        self.kb_dir = kb_dir
+        self.faq_path = os.path.join(kb_dir, "faq.json")
+        self.docs_dir = os.path.join(kb_dir, "docs")
+        self.index = BM25Index()
+        self.faq: Dict[str, Dict[str, str]] = {}
+        self.chunks: Dict[str, str] = {}  # chunk_id -> 文本
+        self._doc_state: Dict[str, Tuple[float, List[str]]] = {}  # 文件名 -> (mtime, chunk_ids)
+        self._next_faq_id = 1
+        # _lock 保护内存中的索引，lookup() 在事件循环上获取它，因此持有期间只做内存操作；
+        # _write_lock 串行化各个更新操作，读文件、切片切词与写 FAQ 文件都在 _lock 之外、_write_lock 之内完成
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    # --- 加载与持久化 ---
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """首次使用前从磁盘加载；并发调用时只加载一次，其余调用等待加载完成"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load()
+
+    def preload_in_background(self) -> None:
+        """启动时在后台线程预热索引，避免第一条消息在事件循环上等待磁盘加载"""
+        threading.Thread(target=self.ensure_loaded, name="knowledge-base-preload", daemon=True).start()
+
+    def load(self) -> None:
+        try:
+            entries = []
+            if os.path.exists(self.faq_path):
+                try:
+                    with open(self.faq_path, "r", encoding="utf-8") as f:
+                        entries = [(entry, BM25Index.term_frequencies(entry["question"])) for entry in json.load(f)]
+                except Exception as e:
+                    logger.error(f"[knowledge_base] 加载 FAQ 文件 {self.faq_path} 失败: {e}")
+            with self._lock:
+                for entry, terms in entries:
+                    self._index_faq(entry, terms)
+            stats = self.refresh_documents()
+        finally:
+            self._loaded = True
+        logger.info(f"[knowledge_base] 知识库已加载: FAQ {len(self.faq)} 条, 文档片段 {len(self.chunks)} 个 ({stats})。")
+
+    def _index_faq(self, entry: Dict[str, str], terms: Tuple[Dict[str, int], int]) -> None:
+        """需持有 _lock；terms 为预先在锁外计算的问题词频"""
+        faq_id = str(entry["id"])
+        self.faq[faq_id] = {"id": faq_id, "question": entry["question"], "answer": entry["answer"]}
+        self.index.add_terms(f"faq:{faq_id}", *terms)
+        if faq_id.isdigit():
+            self._next_faq_id = max(self._next_faq_id, int(faq_id) + 1)
+
+    def _save_faq(self, entries: List[Dict[str, str]]) -> None:
+        """需持有 _write_lock (保证按更新顺序落盘)，不能持有 _lock"""
+        os.makedirs(self.kb_dir, exist_ok=True)
+        tmp_path = self.faq_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.faq_path)
+
+    # --- 增量更新 ---
+    def add_faq(self, question: str, answer: str) -> str:
+        # _save_faq 写出的是内存中的全部条目，必须先加载已有 FAQ，否则会覆盖掉磁盘上的内容
+        self.ensure_loaded()
+        terms = BM25Index.term_frequencies(question)
+        with self._write_lock:
+            with self._lock:
+                faq_id = str(self._next_faq_id)
+                self._index_faq({"id": faq_id, "question": question, "answer": answer}, terms)
+                entries = list(self.faq.values())
+            self._save_faq(entries)
+        return faq_id
+
+    def remove_faq(self, faq_id: str) -> bool:
+        self.ensure_loaded()
+        with self._write_lock:
+            with self._lock:
+                if faq_id not in self.faq:
+                    return False
+                del self.faq[faq_id]
+                self.index.remove(f"faq:{faq_id}")
+                entries = list(self.faq.values())
+            self._save_faq(entries)
+        return True
+
+    def refresh_documents(self) -> str:
+        """只重新索引新增、修改或删除的文档文件，返回变更摘要"""
+        with self._write_lock:
+            current: Dict[str, float] = {}
+            if os.path.isdir(self.docs_dir):
+                for filename in os.listdir(self.docs_dir):
+                    if filename.endswith(KB_DOC_SUFFIXES):
+                        current[filename] = os.path.getmtime(os.path.join(self.docs_dir, filename))
+            removed_files = [filename for filename in self._doc_state if filename not in current]
+
+            # 在锁外读文件、切片并切词，_lock 内只把结果换入索引
+            changed: Dict[str, Tuple[float, List[Tuple[str, str, Tuple[Dict[str, int], int]]]]] = {}
+            for filename, mtime in current.items():
+                state = self._doc_state.get(filename)
+                if state is not None and state[0] == mtime:
+                    continue
+                try:
+                    with open(os.path.join(self.docs_dir, filename), "r", encoding="utf-8") as f:
+                        text = f.read()
+                except Exception as e:
+                    logger.error(f"[knowledge_base] 读取文档 {filename} 失败: {e}")
+                    continue
+                changed[filename] = (mtime, [(f"doc:{filename}#{i}", chunk, BM25Index.term_frequencies(chunk))
+                                             for i, chunk in enumerate(_chunk_document(text))])
+
+            updated = sum(1 for filename in changed if filename in self._doc_state)
+            with self._lock:
+                for filename in removed_files:
+                    self._drop_document(filename)
+                for filename, (mtime, chunks) in changed.items():
+                    self._drop_document(filename)
+                    for chunk_id, chunk, terms in chunks:
+                        self.chunks[chunk_id] = chunk
+                        self.index.add_terms(chunk_id, *terms)
+                    self._doc_state[filename] = (mtime, [chunk_id for chunk_id, _, _ in chunks])
+        return f"新增 {len(changed) - updated} 个, 更新 {updated} 个, 删除 {len(removed_files)} 个文档"
+
+    def _drop_document(self, filename: str) -> None:
+        _, chunk_ids = self._doc_state.pop(filename, (0.0, []))
+        for chunk_id in chunk_ids:
+            self.chunks.pop(chunk_id, None)
+            self.index.remove(chunk_id)
+
+    # --- 检索 ---
+    def lookup(self, message_text: str) -> Dict[str, Any]:
+        """
+        返回 {"mode": "direct"|"context"|"none", "answer", "context", "confidence"}。
+        direct: FAQ 问题与消息双向覆盖率都达到 QQBOT_KB_DIRECT_THRESHOLD，直接返回答案；
+        context: 最佳命中的查询覆盖率达到 QQBOT_KB_CONTEXT_THRESHOLD，返回拼接好的参考资料。
+        首次调用会同步加载知识库，事件循环中应先在线程中调用 ensure_loaded。
+        """
+        self.ensure_loaded()
+        result: Dict[str, Any] = {"mode": "none", "answer": None, "context": None, "confidence": 0.0}
+        if not len(self.index):
+            return result
+        started_at = time.perf_counter()
+        direct_threshold = _float_env("QQBOT_KB_DIRECT_THRESHOLD", 0.85)
+        context_threshold = _float_env("QQBOT_KB_CONTEXT_THRESHOLD", 0.4)
+        with self._lock:
+            hits = self.index.search(message_text, limit=3)
+            if not hits:
+                return result
+            doc_id, _, query_cov, doc_cov = hits[0]
+            result["confidence"] = round(query_cov, 3)
+            if doc_id.startswith("faq:") and min(query_cov, doc_cov) >= direct_threshold:
+                result["mode"] = "direct"
+                result["answer"] = self.faq[doc_id[4:]]["answer"]
+            else:
+                snippets = []
+                total = 0
+                for hit_id, _, cov, _ in hits:
+                    if cov < context_threshold:
+                        continue
+                    if hit_id.startswith("faq:"):
+                        entry = self.faq[hit_id[4:]]
+                        snippet = f"问: {entry['question']}\n答: {entry['answer']}"
+                    else:
+                        snippet = self.chunks[hit_id]
+                    if total + len(snippet) > CONTEXT_MAX_CHARS and snippets:
+                        break
+                    snippets.append(snippet)
+                    total += len(snippet)
+                if snippets:
+                    result["mode"] = "context"
+                    result["context"] = "\n---\n".join(snippets)
+        logger.debug("[knowledge_base] 检索完成 mode={} confidence={} 耗时={:.2f}ms", result["mode"],
+                     result["confidence"], (time.perf_counter() - started_at) * 1000)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"faq": len(self.faq), "documents": len(self._doc_state), "chunks": len(self.chunks),
+                "terms": len(self.index.postings)}
+
+
+# 全局单例，首次检索时加载
+knowledge_base = KnowledgeBase()
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from contextlib import asynccontextmanager
+from loguru import logger
+from typing import List, Any, Callable, Awaitable, Optional, Tuple
+
+# --- 进程生命周期管理 ---
+# 收到 SIGTERM (systemd stop/restart) 后: 停止接收新事件 -> 在宽限期内等待进行中的 LLM 调用完成 ->
+# 关闭连接池中的客户端 -> 落盘脏会话与统计数据 -> 删除运行标记并退出。
+# 启动时若发现上次遗留的运行标记，说明上次未正常退出，会执行各模块注册的恢复操作。
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(PROJECT_ROOT_DIR, "data")
+RUNNING_MARKER_PATH = os.path.join(DATA_DIR, ".running")
+
+try:
+    SHUTDOWN_GRACE_SECONDS = float(os.getenv("QQBOT_SHUTDOWN_GRACE_SECONDS", "20"))
+except ValueError:
+    SHUTDOWN_GRACE_SECONDS = 20.0
+
+
+class LifecycleManager:
+    def __init__(self, marker_path: str = RUNNING_MARKER_PATH, grace_seconds: float = SHUTDOWN_GRACE_SECONDS):
+        self.marker_path = marker_path
+        self.grace_seconds = grace_seconds
+        self.accepting = True
+        self.in_flight = 0
+        self._idle_event: Optional[asyncio.Event] = None
+        self._flush_hooks: List[Tuple[str, Callable[[], Any]]] = []
+        self._close_hooks: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._recovery_hooks: List[Tuple[str, Callable[[], Any]]] = []
+        self._shutting_down = False
+        self._finalized = False
+
+    # --- 注册 ---
+    def register_flush_hook(self, name: str, func: Callable[[], Any]) -> None:
+        """退出时同步调用，用于把内存中的脏数据落盘。按注册顺序执行。"""
+        self._flush_hooks.append((name, func))
+
+    def register_close_hook(self, name: str, func: Callable[[], Awaitable[Any]]) -> None:
+        """退出时在事件循环中等待的异步关闭操作，例如关闭连接池中的 HTTP 客户端。"""
+        self._close_hooks.append((name, func))
+
+    def register_recovery_hook(self, name: str, func: Callable[[], Any]) -> None:
+        """检测到上次未正常退出时，在启动阶段同步调用。"""
+        self._recovery_hooks.append((name, func))
+
+    # --- 进行中的调用 ---
+    @asynccontextmanager
+    async def track(self):
+        """包裹一次消息处理，统计进行中的调用数，供退出时等待"""
+        self.in_flight += 1
+        if self._idle_event is not None:
+            self._idle_event.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0 and self._idle_event is not None:
+                self._idle_event.set()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待进行中的调用结束，返回是否在超时前全部完成"""
+        timeout = self.grace_seconds if timeout is None else timeout
+        if self.in_flight == 0:
+            return True
+        self._idle_event = asyncio.Event()
+        logger.info(f"[lifecycle] 等待 {self.in_flight} 个进行中的调用完成 (最多 {timeout:.0f} 秒)...")
+        try:
+            await asyncio.wait_for(self._idle_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"[lifecycle] 宽限期已到，仍有 {self.in_flight} 个调用未完成，将强制退出。")
+            return False
+
+    # --- 启动 / 恢复 ---
+    def startup(self) -> bool:
+        """写入运行标记；若上次未正常退出则先执行恢复。返回上次是否为异常退出。"""
+        unclean = os.path.exists(self.marker_path)
+        if unclean:
+            previous = {}
+            try:
+                with open(self.marker_path, "r", encoding="utf-8") as f:
+                    previous = json.load(f)
+            except Exception:
+                pass
+            logger.warning(
+                f"[lifecycle] 检测到上次运行 (pid={previous.get('pid', '?')}, 启动于 {previous.get('started_at', '?')}) "
+                f"未正常退出，开始执行恢复..."
+            )
+            for name, func in self._recovery_hooks:
+                try:
+                    func()
+                    logger.info(f"[lifecycle] 恢复操作 '{name}' 完成。")
+                except Exception as e:
+                    logger.exception(f"[lifecycle] 恢复操作 '{name}' 失败: {e}")
+        try:
+            os.makedirs(os.path.dirname(self.marker_path), exist_ok=True)
+            with open(self.marker_path, "w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "started_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+        except Exception as e:
+            logger.error(f"[lifecycle] 写入运行标记 {self.marker_path} 失败: {e}")
+        return unclean
+
+    # --- 退出 ---
+    def install_signal_handlers(self) -> None:
+        """接管 SIGTERM (systemd 停止服务时发送)。SIGINT 仍由 KeyboardInterrupt 流程处理。"""
+        try:
+            signal.signal(signal.SIGTERM, self._on_signal)
+            logger.info(f"[lifecycle] 已安装 SIGTERM 处理器，退出宽限期 {self.grace_seconds:.0f} 秒。")
+        except (ValueError, AttributeError) as e:  # 非主线程或平台不支持
+            logger.warning(f"[lifecycle] 无法安装 SIGTERM 处理器: {e}")
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        if self._shutting_down:
+            logger.warning(f"[lifecycle] 再次收到信号 {signum}，立即退出。")
+            self.finalize()
+            raise SystemExit(1)
+        self._shutting_down = True
+        self.accepting = False
+        logger.info(f"[lifecycle] 收到信号 {signum}，停止接收新消息并开始优雅退出。")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not loop.is_running():
+            self.finalize()
+            raise SystemExit(0)
+        # signal.signal 安装的处理函数不会唤醒阻塞在 select 上的空闲事件循环，直接 create_task 要等到下一个定时器
+        # 触发才会开始退出；call_soon_threadsafe 会写入事件循环的自唤醒管道，立即开始退出流程。
+        # (NcatBot 在 bot.run 内部才创建事件循环，安装处理器时还拿不到循环，因此不用 loop.add_signal_handler)
+        loop.call_soon_threadsafe(self._start_shutdown, loop)
+
+    def _start_shutdown(self, loop: asyncio.AbstractEventLoop) -> None:
+        task = loop.create_task(self._shutdown_and_exit())
+        # 取回任务结果，避免退出时打印 "Task exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def shutdown(self) -> None:
+        """停止接收新消息、等待进行中的调用、关闭客户端并落盘。可在事件循环中直接调用。"""
+        self.accepting = False
+        await self.drain()
+        for name, func in self._close_hooks:
+            try:
+                await func()
+            except Exception as e:
+                logger.warning(f"[lifecycle] 关闭 '{name}' 时出错: {e}")
+        self.finalize()
+
+    async def _shutdown_and_exit(self) -> None:
+        await self.shutdown()
+        # SystemExit 会从事件循环中传播出去，使 bot.run 返回并执行 bot.py 中的 finally
+        raise SystemExit(0)
+
+    def finalize(self) -> None:
+        """同步落盘所有数据并删除运行标记。幂等，bot.py 的 finally 中也会调用。"""
+        if self._finalized:
+            return
+        self._finalized = True
+        self.accepting = False
+        for name, func in self._flush_hooks:
+            try:
+                func()
+                logger.info(f"[lifecycle] 已落盘: {name}")
+            except Exception as e:
+                logger.exception(f"[lifecycle] 落盘 '{name}' 失败: {e}")
+        try:
+            if os.path.exists(self.marker_path):
+                os.remove(self.marker_path)
+        except Exception as e:
+            logger.error(f"[lifecycle] 删除运行标记 {self.marker_path} 失败: {e}")
+        logger.info("[lifecycle] 已完成退出前的清理。")
+
+
+# 全局单例
+lifecycle = LifecycleManager()
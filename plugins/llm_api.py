@@ -1,31 +1,79 @@
 import os
 import asyncio
+import importlib
+import importlib.util
 import sys
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from loguru import logger
 
-# --- LLM SDK 导入 ---
-try:
-    import openai
+from .usage_stats import usage_recorder, extract_usage
+from .perf_metrics import perf_metrics
 
-    OPENAI_AVAILABLE = True
-except ImportError:
-    openai = None
-    OPENAI_AVAILABLE = False
-try:
-    import anthropic
+# --- LLM SDK 延迟导入 ---
+# openai / anthropic / zhipuai 及其 httpx、pydantic 依赖树导入较慢且占用内存，
+# 而实际只会用到 LLM_PROVIDER 指定的那一个，因此各 SDK 只在首次调用对应提供商时才导入。
+_sdk_modules: Dict[str, Any] = {}
 
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    anthropic = None
-    ANTHROPIC_AVAILABLE = False
-try:
-    import zhipuai
 
-    ZHIPUAI_AVAILABLE = True
-except ImportError:
-    zhipuai = None
-    ZHIPUAI_AVAILABLE = False
+def _load_sdk(module_name: str) -> Any:
+    """导入并缓存 SDK 模块，未安装时返回 None"""
+    if module_name not in _sdk_modules:
+        try:
+            _sdk_modules[module_name] = importlib.import_module(module_name)
+            logger.debug(f"已延迟导入 LLM SDK: {module_name}")
+        except ImportError:
+            logger.warning(f"LLM SDK {module_name} 未安装。")
+            _sdk_modules[module_name] = None
+    return _sdk_modules[module_name]
+
+
+def _sdk_installed(module_name: str) -> bool:
+    """只查找模块而不导入，用于快速判断 SDK 是否可用"""
+    if module_name in _sdk_modules:
+        return _sdk_modules[module_name] is not None
+    return importlib.util.find_spec(module_name) is not None
+
+
+class ProviderCallError(Exception):
+    """
+    适配器调用失败 (SDK 缺失、Key 未配置、API 报错等)。异常消息即返回给用户的提示文本，
+    generate_response 捕获后照常回复该文本，并计入诊断中的错误率。
+    """
+
+
+# --- 客户端连接池 ---
+# 按 (提供商, API Key) 复用 SDK 客户端，避免每次调用都新建 HTTP 连接池；退出时由 close_provider_clients 统一关闭
+_client_pool: Dict[Tuple[str, str], Any] = {}
+
+
+def _get_pooled_client(key: Tuple[str, str], factory: Callable[[], Any]) -> Any:
+    client = _client_pool.get(key)
+    if client is None:
+        client = factory()
+        _client_pool[key] = client
+    return client
+
+
+async def close_provider_clients() -> None:
+    """关闭连接池中的所有客户端以及各适配器自行持有的资源"""
+    clients = list(_client_pool.values())
+    _client_pool.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.warning(f"关闭 LLM 客户端 {type(client).__name__} 时出错: {e}")
+    for adapter in list(_providers.values()):
+        try:
+            await adapter.aclose()
+        except Exception as e:
+            logger.warning(f"关闭 LLM 提供商适配器 {adapter.name} 时出错: {e}")
 
 
 class LLMInterface:
@@ -47,21 +95,15 @@ class LLMInterface:
             temperature: float = 0.7,
             max_tokens: Optional[int] = None,
             enable_web_search: Optional[bool] = None,
+            session_id: Optional[str] = None,
             **kwargs
     ) -> str:
         effective_provider = (provider or os.getenv("LLM_PROVIDER", "zhipu")).lower()
+        adapter = get_provider(effective_provider)
+        if adapter is None:
+            return f"不支持的模型提供商: {effective_provider}"
 
-        if model:
-            effective_model = model
-        else:
-            if effective_provider == "zhipu":
-                effective_model = os.getenv("GLM_MODEL", LLMInterface.DEFAULT_ZHIPU_MODEL_FALLBACK)
-            elif effective_provider == "openai":
-                effective_model = os.getenv("OPENAI_MODEL", LLMInterface.DEFAULT_OPENAI_MODEL_FALLBACK)
-            elif effective_provider == "claude":
-                effective_model = os.getenv("CLAUDE_MODEL", LLMInterface.DEFAULT_CLAUDE_MODEL_FALLBACK)
-            else:
-                effective_model = "unknown-model-fallback"  # Should not happen with default
+        effective_model = model or adapter.default_model()
 
         if max_tokens is not None:
             effective_max_tokens = max_tokens
@@ -76,8 +118,8 @@ class LLMInterface:
                 effective_max_tokens = LLMInterface.DEFAULT_MAX_TOKENS_FALLBACK
 
         if enable_web_search is None:
-            if effective_provider == "zhipu":
-                logger.warning("enable_web_search 未由调用者明确提供给Zhipu，默认设为True以符合预期行为 (llm_api.py)")
+            if adapter.supports_web_search:
+                logger.warning(f"enable_web_search 未由调用者明确提供给 {effective_provider}，默认设为True以符合预期行为 (llm_api.py)")
                 effective_enable_web_search = True
             else:
                 effective_enable_web_search = False
@@ -86,76 +128,103 @@ class LLMInterface:
 
         effective_temperature = temperature
 
+        # 高频调用路径上的日志使用 {} 占位参数，未启用对应级别时不做格式化
         logger.debug(
-            f"LLMInterface (llm_api.py): Effective - Provider='{effective_provider}', Model='{effective_model}', "
-            f"MaxTokens='{effective_max_tokens}', WebSearch(param)='{enable_web_search}', EffectiveWebSearch='{effective_enable_web_search}', Temp='{effective_temperature}'"
+            "LLMInterface (llm_api.py): Effective - Provider='{}', Model='{}', MaxTokens='{}', WebSearch(param)='{}', "
+            "EffectiveWebSearch='{}', Temp='{}'",
+            effective_provider, effective_model, effective_max_tokens, enable_web_search,
+            effective_enable_web_search, effective_temperature
         )
 
+        if not adapter.sdk_available():
+            return f"{adapter.display_name} SDK 未安装"
+        started_at = time.monotonic()
+        failed = False
         try:
-            if effective_provider == "openai":
-                if not OPENAI_AVAILABLE: return "OpenAI SDK 未安装"
-                return await LLMInterface._call_openai(messages, effective_model, effective_temperature,
-                                                       effective_max_tokens)
-            elif effective_provider == "claude":
-                if not ANTHROPIC_AVAILABLE: return "Anthropic SDK 未安装"
-                return await LLMInterface._call_claude(messages, effective_model, effective_temperature,
-                                                       effective_max_tokens)
-            elif effective_provider == "zhipu":
-                if not ZHIPUAI_AVAILABLE: return "ZhipuAI SDK 未安装"
-                return await LLMInterface._call_zhipu(messages, effective_model, effective_temperature,
-                                                      effective_max_tokens,
-                                                      effective_enable_web_search)
-            else:
-                return f"不支持的模型提供商: {effective_provider}"
+            reply = await adapter.generate(messages, effective_model, effective_temperature, effective_max_tokens,
+                                           effective_enable_web_search, session_id)
+        except ProviderCallError as e:
+            # 适配器已记录详细日志，这里只把提示文本返回给用户
+            failed = True
+            reply = str(e)
         except Exception as e:
             logger.exception(f"生成回复时发生错误 ({effective_provider}, model: {effective_model}): {e}")
-            return f"AI服务 ({effective_provider}) 暂时不可用: {str(e)}"
+            failed = True
+            reply = f"AI服务 ({effective_provider}) 暂时不可用: {str(e)}"
+        elapsed = time.monotonic() - started_at
+        perf_metrics.record_llm_call(effective_provider, elapsed, error=failed or not reply)
+        # 按消息记录一次：一条消息可能对应多次 API 调用 (如联网无结果后的后备调用)
+        usage_recorder.record_message(effective_provider, effective_enable_web_search, int(elapsed * 1000),
+                                      failed=failed or not reply)
+        return reply
+
+    @staticmethod
+    def _record_usage(provider: str, model: str, session_id: Optional[str], response: Any, started_at: float,
+                      web_search: bool = False) -> None:
+        """记录一次调用的 token 用量与耗时。统计失败绝不影响回复路径。"""
+        try:
+            prompt_tokens, completion_tokens, cached_tokens = extract_usage(getattr(response, "usage", None))
+            usage_recorder.record(provider, model, session_id, prompt_tokens, completion_tokens, cached_tokens,
+                                  latency_ms=int((time.monotonic() - started_at) * 1000), web_search=web_search)
+        except Exception as e:
+            logger.warning(f"记录 {provider} 用量数据失败: {e}")
 
     @staticmethod
-    async def _call_openai(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> str:
-        if not openai: return "OpenAI SDK not loaded (internal check)."
+    async def _call_openai(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int,
+                           session_id: Optional[str] = None) -> str:
+        openai = _load_sdk("openai")
+        if not openai: raise ProviderCallError("OpenAI SDK not loaded (internal check).")
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key or openai_api_key == "your_openai_api_key_here": return "OpenAI API Key未配置"
-        client = openai.AsyncOpenAI(api_key=openai_api_key)
+        if not openai_api_key or openai_api_key == "your_openai_api_key_here": raise ProviderCallError("OpenAI API Key未配置")
+        client = _get_pooled_client(("openai", openai_api_key), lambda: openai.AsyncOpenAI(api_key=openai_api_key))
         try:
+            started_at = time.monotonic()
             response = await client.chat.completions.create(model=model, messages=messages, temperature=temperature,
                                                             max_tokens=max_tokens)
+            LLMInterface._record_usage("openai", model, session_id, response, started_at)
             return response.choices[0].message.content or ""
         except Exception as e:
             logger.exception(f"OpenAI API 调用失败 (model: {model}): {e}")
-            return f"OpenAI API 调用失败: {str(e)}"
+            raise ProviderCallError(f"OpenAI API 调用失败: {str(e)}")
 
     @staticmethod
-    async def _call_claude(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> str:
-        if not anthropic: return "Anthropic SDK not loaded (internal check)."
+    async def _call_claude(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int,
+                           session_id: Optional[str] = None) -> str:
+        anthropic = _load_sdk("anthropic")
+        if not anthropic: raise ProviderCallError("Anthropic SDK not loaded (internal check).")
         api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key or api_key == "your_anthropic_api_key_here": return "Anthropic API Key未配置"
-        client = anthropic.AsyncAnthropic(api_key=api_key)
+        if not api_key or api_key == "your_anthropic_api_key_here": raise ProviderCallError("Anthropic API Key未配置")
+        client = _get_pooled_client(("claude", api_key), lambda: anthropic.AsyncAnthropic(api_key=api_key))
         system_messages = [m["content"] for m in messages if m["role"] == "system"]
         system_prompt = "\n".join(system_messages) if system_messages else None
         conversation = [m for m in messages if m["role"] != "system"]
         try:
+            started_at = time.monotonic()
             response = await client.messages.create(model=model, system=system_prompt, messages=conversation,
                                                     temperature=temperature, max_tokens=max_tokens)
+            LLMInterface._record_usage("claude", model, session_id, response, started_at)
             if response.content and isinstance(response.content, list) and len(response.content) > 0 and hasattr(
                     response.content[0], 'text'):
                 return response.content[0].text or ""
             logger.warning(f"从Claude (model: {model}) 获取的响应内容格式不符合预期: {response}")
-            return "从Claude获取的响应内容格式不符合预期"
+            raise ProviderCallError("从Claude获取的响应内容格式不符合预期")
+        except ProviderCallError:
+            raise
         except Exception as e:
             logger.exception(f"Claude API 调用失败 (model: {model}): {e}")
-            return f"Claude API 调用失败: {str(e)}"
+            raise ProviderCallError(f"Claude API 调用失败: {str(e)}")
 
     @staticmethod
     async def _call_zhipu(
             messages: List[Dict[str, str]], model_name: str, temperature: float,
-            max_tokens: int, enable_web_search: bool
+            max_tokens: int, enable_web_search: bool, session_id: Optional[str] = None
     ) -> str:
-        if not zhipuai: return "ZhipuAI SDK not loaded (internal check)."
+        zhipuai = _load_sdk("zhipuai")
+        if not zhipuai: raise ProviderCallError("ZhipuAI SDK not loaded (internal check).")
         api_key = os.getenv("ZHIPUAI_API_KEY")
         if not api_key or api_key == "your_zhipuai_api_key_here":  # 检查占位符
-            return "ZhipuAI API Key未配置或仍为占位符"
-        client = zhipuai.ZhipuAI(api_key=api_key)
+            raise ProviderCallError("ZhipuAI API Key未配置或仍为占位符")
+        client = _get_pooled_client(("zhipu", api_key), lambda: zhipuai.ZhipuAI(api_key=api_key))
 
         search_attempt_yielded_no_content = False
         response_content = ""
@@ -178,14 +247,15 @@ class LLMInterface:
             #     web_search_tool["web_search"]["search_result"] = True
 
             tools_config.append(web_search_tool)
-            logger.info(f"智谱AI GLM ({model_name}, llm_api.py): 第一次尝试 - 联网搜索已启用 (引擎: search_std)。")
+            logger.info("智谱AI GLM ({}, llm_api.py): 第一次尝试 - 联网搜索已启用 (引擎: search_pro)。", model_name)
         else:
-            logger.info(f"智谱AI GLM ({model_name}, llm_api.py): 第一次尝试 - 联网搜索未启用。")
+            logger.info("智谱AI GLM ({}, llm_api.py): 第一次尝试 - 联网搜索未启用。", model_name)
 
+        started_at = time.monotonic()
         try:
-            logger.debug(
-                f"智谱AI GLM (llm_api.py, 第一次尝试) 参数: Model='{model_name}', Temp='{temperature}', "
-                f"MaxTokens='{max_tokens}', Tools='{tools_config if tools_config else '无'}'"
+            logger.opt(lazy=True).debug(
+                "智谱AI GLM (llm_api.py, 第一次尝试) 参数: Model='{}', Temp='{}', MaxTokens='{}', Tools='{}'",
+                lambda: model_name, lambda: temperature, lambda: max_tokens, lambda: tools_config or '无'
             )
             response = client.chat.completions.create(
                 model=model_name, messages=messages,
@@ -194,6 +264,8 @@ class LLMInterface:
                 tools=tools_config if tools_config else None,  # 传递构造好的tools
                 stream=False
             )
+            LLMInterface._record_usage("zhipu", model_name, session_id, response, started_at,
+                                       web_search=enable_web_search)
 
             message = response.choices[0].message
             response_content = message.content or ""
@@ -201,9 +273,8 @@ class LLMInterface:
             tool_calls = message.   tool_calls  # 检查模型是否要求工具调用
 
             logger.info(
-                f"非流式 (第一次尝试) 完成 模型: {model_name}. "
-                f"结束原因: '{finish_reason}', 是否有工具调用对象: {bool(tool_calls)}, "
-                f"内容长度: {len(response_content)}"
+                "非流式 (第一次尝试) 完成 模型: {}. 结束原因: '{}', 是否有工具调用对象: {}, 内容长度: {}",
+                model_name, finish_reason, bool(tool_calls), len(response_content)
             )
 
             if finish_reason == 'sensitive':
@@ -236,6 +307,9 @@ class LLMInterface:
 
         except Exception as e:
             logger.exception(f"智谱AI GLM ({model_name}, llm_api.py) API调用失败 (第一次尝试): {e}")
+            # 失败的调用同样产生了耗时 (联网时还可能已经检索过)，计入用量统计
+            LLMInterface._record_usage("zhipu", model_name, session_id, None, started_at,
+                                       web_search=enable_web_search)
             # 尝试解析Zhipu特定的API错误
             if hasattr(e, 'response') and hasattr(e.response, 'status_code') and hasattr(e.response, 'json'):
                 try:
@@ -250,17 +324,20 @@ class LLMInterface:
                             )
                             search_attempt_yielded_no_content = True
                         else:
-                            return f"AI服务遇到API层面问题 (代码: {error_code}, 消息: {error_message})"
+                            raise ProviderCallError(f"AI服务遇到API层面问题 (代码: {error_code}, 消息: {error_message})")
+                except ProviderCallError:
+                    raise
                 except Exception as parse_e:
                     logger.error(f"解析智谱AI错误响应失败: {parse_e}")
 
             if not search_attempt_yielded_no_content:  # 如果不是因特定错误进入第二次尝试，则第一次尝试的失败是最终失败
-                return f"AI服务暂时不可用 (调用出错): {str(e)}"
+                raise ProviderCallError(f"AI服务暂时不可用 (调用出错): {str(e)}")
 
         # --- 第二次尝试: 不使用联网搜索 (仅当第一次搜索尝试未产生内容时执行) ---
         if search_attempt_yielded_no_content:
             logger.info(f"智谱AI GLM ({model_name}, llm_api.py): 第二次尝试 - 联网搜索已禁用。")
             try:
+                started_at = time.monotonic()
                 response_no_search = client.chat.completions.create(
                     model=model_name, messages=messages,
                     temperature=max(0.01, min(temperature, 0.99)),
@@ -268,14 +345,16 @@ class LLMInterface:
                     tools=None,  # 明确不使用工具
                     stream=False
                 )
+                # 后备调用是联网搜索无结果引起的，归入联网一侧，避免 "搜索统计" 低估联网的代价
+                LLMInterface._record_usage("zhipu", model_name, session_id, response_no_search, started_at,
+                                           web_search=enable_web_search)
                 message_no_search = response_no_search.choices[0].message
                 content_no_search = message_no_search.content or ""
                 finish_reason_no_search = response_no_search.choices[0].finish_reason
 
                 logger.info(
-                    f"非流式 (第二次尝试 - 无搜索) 完成 模型: {model_name}. "
-                    f"结束原因: '{finish_reason_no_search}', "
-                    f"内容长度: {len(content_no_search)}"
+                    "非流式 (第二次尝试 - 无搜索) 完成 模型: {}. 结束原因: '{}', 内容长度: {}",
+                    model_name, finish_reason_no_search, len(content_no_search)
                 )
 
                 if finish_reason_no_search == 'sensitive':
@@ -292,13 +371,141 @@ class LLMInterface:
                     return LLMInterface.SEARCH_NO_DATA_HINT  # 最终后备提示
             except Exception as e2:
                 logger.exception(f"智谱AI GLM ({model_name}, llm_api.py) API调用失败 (第二次尝试 - 无搜索): {e2}")
-                return f"AI服务暂时不可用 (后备调用出错): {str(e2)}"
+                raise ProviderCallError(f"AI服务暂时不可用 (后备调用出错): {str(e2)}")
 
         logger.error(
             f"智谱AI GLM ({model_name}, llm_api.py): _call_zhipu 意外到达函数末尾。search_attempt_yielded_no_content={search_attempt_yielded_no_content}")
         return LLMInterface.SEARCH_NO_DATA_HINT
 
 
+# --- 提供商适配器注册表 ---
+class ProviderAdapter:
+    """
+    LLM 提供商适配器基类。子类声明 SDK 模块名与默认模型，并实现 generate()；
+    SDK 在 generate() 首次调用时才导入。通过 register_provider() 注册后即可用 LLM_PROVIDER 选择，
+    无需修改 generate_response。调用失败时 generate() 应抛出 ProviderCallError (消息为给用户的提示)，
+    而不是把错误文本当作正常回复返回，否则诊断中的错误率无法统计到这次失败。
+    """
+
+    name = ""
+    display_name = ""
+    sdk_module: Optional[str] = None  # 需要的 SDK 模块名，None 表示不依赖第三方 SDK
+    model_env = ""  # 读取默认模型的环境变量名
+    default_model_fallback = ""
+    supports_web_search = False
+
+    def default_model(self) -> str:
+        return os.getenv(self.model_env, self.default_model_fallback) if self.model_env else self.default_model_fallback
+
+    def sdk_available(self) -> bool:
+        return self.sdk_module is None or _sdk_installed(self.sdk_module)
+
+    async def generate(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int,
+                       enable_web_search: bool, session_id: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        """释放适配器持有的客户端等资源，默认无操作"""
+
+
+class OpenAIAdapter(ProviderAdapter):
+    name = "openai"
+    display_name = "OpenAI"
+    sdk_module = "openai"
+    model_env = "OPENAI_MODEL"
+    default_model_fallback = LLMInterface.DEFAULT_OPENAI_MODEL_FALLBACK
+
+    async def generate(self, messages, model, temperature, max_tokens, enable_web_search, session_id=None) -> str:
+        return await LLMInterface._call_openai(messages, model, temperature, max_tokens, session_id)
+
+
+class ClaudeAdapter(ProviderAdapter):
+    name = "claude"
+    display_name = "Anthropic"
+    sdk_module = "anthropic"
+    model_env = "CLAUDE_MODEL"
+    default_model_fallback = LLMInterface.DEFAULT_CLAUDE_MODEL_FALLBACK
+
+    async def generate(self, messages, model, temperature, max_tokens, enable_web_search, session_id=None) -> str:
+        return await LLMInterface._call_claude(messages, model, temperature, max_tokens, session_id)
+
+
+class ZhipuAdapter(ProviderAdapter):
+    name = "zhipu"
+    display_name = "ZhipuAI"
+    sdk_module = "zhipuai"
+    model_env = "GLM_MODEL"
+    default_model_fallback = LLMInterface.DEFAULT_ZHIPU_MODEL_FALLBACK
+    supports_web_search = True
+
+    async def generate(self, messages, model, temperature, max_tokens, enable_web_search, session_id=None) -> str:
+        return await LLMInterface._call_zhipu(messages, model, temperature, max_tokens, enable_web_search, session_id)
+
+
+PROVIDER_PLUGIN_ENTRY_POINT_GROUP = "qchat_bot.llm_providers"
+
+_providers: Dict[str, ProviderAdapter] = {}
+_provider_plugins_loaded = False
+
+
+def register_provider(adapter: Any) -> Any:
+    """
+    注册提供商适配器，可传入实例或类 (也可作为类装饰器使用)。同名注册会覆盖内置适配器。
+    """
+    instance = adapter() if isinstance(adapter, type) else adapter
+    if not instance.name:
+        raise ValueError(f"提供商适配器 {adapter!r} 未设置 name")
+    _providers[instance.name.lower()] = instance
+    logger.debug(f"已注册 LLM 提供商适配器: {instance.name}")
+    return adapter
+
+
+def load_provider_plugins() -> None:
+    """
+    加载第三方提供商插件 (只执行一次)：
+    1. 已安装包通过 entry point 组 "qchat_bot.llm_providers" 声明的适配器 (类或实例)；
+    2. 环境变量 LLM_PROVIDER_PLUGINS 中以逗号分隔的模块路径，模块导入时自行调用 register_provider。
+    """
+    global _provider_plugins_loaded
+    if _provider_plugins_loaded:
+        return
+    _provider_plugins_loaded = True
+
+    try:
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        group = eps.select(group=PROVIDER_PLUGIN_ENTRY_POINT_GROUP) if hasattr(eps, "select") \
+            else eps.get(PROVIDER_PLUGIN_ENTRY_POINT_GROUP, [])
+        for ep in group:
+            try:
+                register_provider(ep.load())
+                logger.info(f"已从 entry point 加载 LLM 提供商插件: {ep.name}")
+            except Exception as e:
+                logger.error(f"加载 LLM 提供商插件 {ep.name} 失败: {e}")
+    except Exception as e:
+        logger.warning(f"扫描 LLM 提供商 entry point 失败: {e}")
+
+    for module_path in filter(None, (m.strip() for m in os.getenv("LLM_PROVIDER_PLUGINS", "").split(","))):
+        try:
+            importlib.import_module(module_path)
+            logger.info(f"已加载 LLM 提供商插件模块: {module_path}")
+        except Exception as e:
+            logger.error(f"加载 LLM 提供商插件模块 {module_path} 失败: {e}")
+
+
+def get_provider(name: str) -> Optional[ProviderAdapter]:
+    # 第一次查找前先加载全部插件 (不论名称是否已注册)，插件才能按同名覆盖内置适配器
+    load_provider_plugins()
+    return _providers.get(name.lower())
+
+
+for _builtin_adapter in (OpenAIAdapter, ClaudeAdapter, ZhipuAdapter):
+    register_provider(_builtin_adapter)
+
+# 通用 OpenAI 兼容适配器位于独立模块，导入时自行注册 (需在上面的注册表定义之后导入)
+from . import openai_compat  # noqa: E402,F401
+
+
 # --- llm_api.py 的独立测试部分 (可选) ---
 async def main_test_llm_api():
     logger.remove()
@@ -0,0 +1,201 @@
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+from loguru import logger
+from typing import Dict, Any, Optional
+
+# --- 日志配置 ---
+# sync 模式: 与原有行为一致，DEBUG 级别同步写 stderr 和文件，开启 backtrace/diagnose。
+# async 模式: 日志格式化后只放入内存队列，由后台线程写文件 (含轮转与 zip 压缩) 和控制台；关闭代价较高的 diagnose，
+#            并对每条消息都会产生的高频调试日志在进入 loguru 之前做采样，减少事件循环线程上的日志开销。
+# 注: loguru 自带的 enqueue=True 基于多进程队列，每条日志都要 pickle，实测在调用方线程上反而比同步写文件更慢，
+#     因此这里使用线程队列实现后台写入。
+LOG_MODE_SYNC = "sync"
+LOG_MODE_ASYNC = "async"
+
+LOG_ROTATION_BYTES = 20 * 1024 * 1024
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class SampledLogger:
+    """
+    高频日志的采样包装：每个日志模板每 rate 次只真正调用一次 loguru。
+    被丢弃的调用在构造日志记录之前就返回，因此几乎没有开销。参数使用 {} 占位并延迟求值 (opt(lazy=True))。
+    """
+
+    def __init__(self, rate: int = 1):
+        self.rate = max(1, rate)
+        self._counters: Dict[str, int] = {}
+
+    def _should_log(self, message: str) -> bool:
+        if self.rate == 1:
+            return True
+        # 计数在事件循环线程上进行，竞争导致的少量误差对采样无影响，不加锁
+        count = self._counters.get(message, 0)
+        self._counters[message] = count + 1
+        return count % self.rate == 0
+
+    def debug(self, message: str, *args: Any) -> None:
+        if self._should_log(message):
+            logger.opt(lazy=True, depth=1).debug(message, *args)
+
+    def info(self, message: str, *args: Any) -> None:
+        if self._should_log(message):
+            logger.opt(lazy=True, depth=1).info(message, *args)
+
+
+# 高频日志统一通过 sampled_logger 输出，采样率由 configure_logging 根据模式设置
+sampled_logger = SampledLogger()
+
+
+class _BackgroundSink:
+    """
+    loguru 的流式 sink (提供 write/stop)：调用方线程只把已格式化的日志放入 queue.SimpleQueue，
+    由后台线程批量调用 _write_batch 真正输出。loguru 在 remove() 时会调用 stop()。
+    """
+
+    def __init__(self, thread_name: str):
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._writer_loop, name=thread_name, daemon=True)
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        self._queue.put(message)
+
+    def _writer_loop(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            batch = [message]
+            # 一次取空队列，合并成一次写入
+            try:
+                while True:
+                    message = self._queue.get_nowait()
+                    if message is None:
+                        self._write_batch(batch)
+                        return
+                    batch.append(message)
+            except queue.Empty:
+                pass
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        """写完队列中剩余的日志后关闭输出，由 loguru 在 remove() 时调用"""
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        try:
+            self._close()
+        except Exception:
+            pass
+
+
+class BackgroundConsoleSink(_BackgroundSink):
+    """在后台线程写 stderr，事件循环线程不会因终端或 journald 管道写满而阻塞"""
+
+    def __init__(self, stream: Any = None):
+        self.stream = stream or sys.stderr
+        super().__init__("log-console-writer")
+
+    def _write_batch(self, batch: list) -> None:
+        try:
+            self.stream.write("".join(batch))
+            self.stream.flush()
+        except Exception:
+            pass
+
+
+class BackgroundFileSink(_BackgroundSink):
+    """在后台线程写文件、按大小轮转并把旧文件压缩为 zip"""
+
+    def __init__(self, logs_dir: str, rotation_bytes: int = LOG_ROTATION_BYTES):
+        self.logs_dir = logs_dir
+        self.rotation_bytes = rotation_bytes
+        self._file = None
+        self._file_path = ""
+        self._written = 0
+        self._open_new_file()
+        super().__init__("log-file-writer")
+
+    def _open_new_file(self) -> None:
+        stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        self._file_path = os.path.join(self.logs_dir, f"bot_{stamp}_{os.getpid()}.log")
+        self._file = open(self._file_path, "a", encoding="utf-8")
+        self._written = 0
+
+    def _rotate(self) -> None:
+        old_path = self._file_path
+        self._file.close()
+        self._open_new_file()
+        try:
+            with zipfile.ZipFile(old_path + ".zip", "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                zf.write(old_path, arcname=os.path.basename(old_path))
+            os.remove(old_path)
+        except Exception as e:
+            sys.stderr.write(f"WARNING: 压缩日志文件 {old_path} 失败: {e}\n")
+
+    def _write_batch(self, batch: list) -> None:
+        data = "".join(batch)
+        try:
+            self._file.write(data)
+            self._file.flush()
+            self._written += len(data.encode("utf-8"))
+            if self._written >= self.rotation_bytes:
+                self._rotate()
+        except Exception as e:
+            sys.stderr.write(f"WARNING: 写入日志文件失败: {e}\n")
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+def configure_logging(logs_dir: str, mode: Optional[str] = None, console: bool = True) -> str:
+    """
+    按模式配置 loguru 处理器，返回实际使用的模式。
+    mode 为 None 时从环境变量 QQBOT_LOG_MODE 读取 (默认 sync)。
+    async 模式下日志级别由 QQBOT_LOG_LEVEL (默认 INFO) 控制，采样率由 QQBOT_LOG_SAMPLE_RATE (默认 10) 控制。
+    """
+    mode = (mode or os.getenv("QQBOT_LOG_MODE", LOG_MODE_SYNC)).lower()
+    if mode not in (LOG_MODE_SYNC, LOG_MODE_ASYNC):
+        sys.stderr.write(f"WARNING: 未知的 QQBOT_LOG_MODE '{mode}'，回退到 {LOG_MODE_SYNC}。\n")
+        mode = LOG_MODE_SYNC
+
+    logger.remove()
+
+    if mode == LOG_MODE_SYNC:
+        sampled_logger.rate = 1
+        if console:
+            logger.add(sys.stderr, level="DEBUG")
+        try:
+            logger.add(os.path.join(logs_dir, "bot_{time}.log"), rotation="20 MB", level="DEBUG", compression="zip",
+                       encoding="utf-8", backtrace=True, diagnose=True)
+        except Exception as e:
+            sys.stderr.write(f"CRITICAL: 添加文件日志失败: {e}\n")
+        return mode
+
+    level = os.getenv("QQBOT_LOG_LEVEL", "INFO").upper()
+    sampled_logger.rate = max(1, _int_env("QQBOT_LOG_SAMPLE_RATE", 10))
+    if console:
+        # 控制台同样经后台线程输出；BackgroundConsoleSink 没有 isatty，需要显式指定是否着色
+        logger.add(BackgroundConsoleSink(sys.stderr), level=level, backtrace=False, diagnose=False,
+                   colorize=sys.stderr.isatty())
+    try:
+        logger.add(BackgroundFileSink(logs_dir), level=level, backtrace=True, diagnose=False)
+    except Exception as e:
+        sys.stderr.write(f"CRITICAL: 添加文件日志失败: {e}\n")
+    return mode
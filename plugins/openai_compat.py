@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import time
+from loguru import logger
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from .llm_api import LLMInterface, ProviderAdapter, ProviderCallError, register_provider, _load_sdk
+from .usage_stats import usage_recorder, extract_usage
+
+# --- 通用 OpenAI 兼容提供商 (LLM_PROVIDER=openai_compat) ---
+# 面向 vLLM / llama.cpp server 等本地 OpenAI 兼容推理服务：端点、请求头与模型名映射均可配置。
+# 设置 OPENAI_COMPAT_BATCH_WINDOW_MS > 0 时启用微批处理：在窗口内到达的并发请求 (相同模型与采样参数)
+# 会被渲染成 prompt 列表，合并成一次 /completions 批量请求，由后端一次性推理。
+
+
+def _json_env(name: str) -> Dict[str, str]:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+        if isinstance(value, dict):
+            return {str(k): str(v) for k, v in value.items()}
+        logger.warning(f"[openai_compat] 环境变量 {name} 不是 JSON 对象，已忽略。")
+    except json.JSONDecodeError as e:
+        logger.warning(f"[openai_compat] 解析环境变量 {name} 失败: {e}，已忽略。")
+    return {}
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def render_chatml(messages: List[Dict[str, str]]) -> str:
+    """把对话渲染成 ChatML 文本，供只接受纯文本 prompt 的批量 /completions 接口使用"""
+    parts = [f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>" for m in messages]
+    parts.append("<|im_start|>assistant\n")
+    return "\n".join(parts)
+
+
+CHATML_STOP = ["<|im_end|>", "<|im_start|>"]
+
+# 批次键: (model, temperature, max_tokens)
+_BatchKey = Tuple[str, float, int]
+
+
+class CompletionBatcher:
+    """
+    把窗口期内到达的并发请求合并为一次 /completions 批量调用 (prompt 为列表)。
+    同一批次内的请求必须使用相同的模型与采样参数；达到 max_batch_size 时立即发送。
+    """
+
+    def __init__(self, adapter: "OpenAICompatAdapter", window_seconds: float, max_batch_size: int):
+        self.adapter = adapter
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: Dict[_BatchKey, List[Tuple[str, Optional[str], asyncio.Future]]] = {}
+        self._timers: Dict[_BatchKey, asyncio.TimerHandle] = {}
+        # 事件循环只持有任务的弱引用，这里保留进行中的批次任务，避免被垃圾回收
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, model: str, prompt: str, temperature: float, max_tokens: int,
+                     session_id: Optional[str]) -> str:
+        loop = asyncio.get_running_loop()
+        key = (model, temperature, max_tokens)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, session_id, future))
+        if len(batch) >= self.max_batch_size:
+            self._dispatch(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window_seconds, self._dispatch, key)
+        return await future
+
+    def _dispatch(self, key: _BatchKey) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._on_batch_done(t, batch))
+
+    def _on_batch_done(self, task: asyncio.Task, batch: List[Tuple[str, Optional[str], asyncio.Future]]) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            error: BaseException = asyncio.CancelledError()
+        elif task.exception() is not None:
+            error = task.exception()
+            logger.error(f"[openai_compat] 批次任务异常结束 (batch={len(batch)}): {error!r}")
+        else:
+            return
+        # 批次任务意外结束时，让仍在等待的请求失败返回，而不是永远挂起
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run_batch(self, key: _BatchKey, batch: List[Tuple[str, Optional[str], asyncio.Future]]) -> None:
+        model, temperature, max_tokens = key
+        prompts = [item[0] for item in batch]
+        started_at = time.monotonic()
+        try:
+            client = self.adapter.get_client()
+            response = await client.completions.create(model=model, prompt=prompts, temperature=temperature,
+                                                       max_tokens=max_tokens, stop=CHATML_STOP)
+        except Exception as e:
+            logger.exception(f"[openai_compat] 批量请求失败 (model: {model}, batch={len(batch)}): {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        latency_ms = int((time.monotonic() - started_at) * 1000)
+        texts: List[str] = [""] * len(batch)
+        for choice in response.choices:
+            if 0 <= choice.index < len(texts):
+                texts[choice.index] = (choice.text or "").strip()
+        logger.info("[openai_compat] 批量请求完成 model={} batch={} 耗时={}ms", model, len(batch), latency_ms)
+
+        # 批量响应只有整体 usage，按 prompt / 回复长度比例分摊到各会话
+        prompt_total, completion_total, cached_total = extract_usage(getattr(response, "usage", None))
+        prompt_chars = sum(len(p) for p in prompts) or 1
+        completion_chars = sum(len(t) for t in texts) or 1
+        for (prompt, session_id, future), text in zip(batch, texts):
+            try:
+                usage_recorder.record(
+                    self.adapter.name, model, session_id,
+                    prompt_tokens=prompt_total * len(prompt) // prompt_chars,
+                    completion_tokens=completion_total * len(text) // completion_chars,
+                    cached_tokens=cached_total * len(prompt) // prompt_chars,
+                    latency_ms=latency_ms,
+                )
+            except Exception as e:
+                logger.warning(f"[openai_compat] 记录批量请求用量失败: {e}")
+            if not future.done():
+                future.set_result(text)
+
+
+@register_provider
+class OpenAICompatAdapter(ProviderAdapter):
+    """
+    通用 OpenAI 兼容适配器。配置 (环境变量):
+      OPENAI_COMPAT_BASE_URL       推理服务地址，如 http://127.0.0.1:8000/v1
+      OPENAI_COMPAT_API_KEY        API Key，本地服务通常可留空
+      OPENAI_COMPAT_MODEL          默认模型名
+      OPENAI_COMPAT_HEADERS        额外请求头 (JSON 对象)
+      OPENAI_COMPAT_MODEL_MAP      模型名映射 (JSON 对象)，把上游传入的模型名 (如 LLM_LIGHT_MODEL) 映射为后端模型名
+      OPENAI_COMPAT_TIMEOUT        请求超时秒数，默认 60
+      OPENAI_COMPAT_BATCH_WINDOW_MS  微批处理窗口 (毫秒)，0 表示关闭 (默认)
+      OPENAI_COMPAT_MAX_BATCH_SIZE   单批最大请求数，默认 8
+    """
+
+    name = "openai_compat"
+    display_name = "OpenAI 兼容服务 (openai)"
+    sdk_module = "openai"
+    model_env = "OPENAI_COMPAT_MODEL"
+    default_model_fallback = "default"
+
+    def __init__(self):
+        self._client = None
+        self._client_config: Optional[Tuple[Any, ...]] = None
+        self._batcher: Optional[CompletionBatcher] = None
+
+    def get_client(self) -> Any:
+        """按当前配置创建并复用 AsyncOpenAI 客户端 (连接池)，配置变化时重建"""
+        base_url = os.getenv("OPENAI_COMPAT_BASE_URL", "http://127.0.0.1:8000/v1")
+        api_key = os.getenv("OPENAI_COMPAT_API_KEY") or "EMPTY"
+        headers = _json_env("OPENAI_COMPAT_HEADERS")
+        timeout = _float_env("OPENAI_COMPAT_TIMEOUT", 60.0)
+        config = (base_url, api_key, tuple(sorted(headers.items())), timeout)
+        if self._client is None or self._client_config != config:
+            openai = _load_sdk("openai")
+            if openai is None:
+                raise RuntimeError("OpenAI SDK 未安装，无法使用 openai_compat 提供商")
+            self._client = openai.AsyncOpenAI(base_url=base_url, api_key=api_key, default_headers=headers or None,
+                                              timeout=timeout)
+            self._client_config = config
+            logger.info(f"[openai_compat] 已创建客户端: base_url={base_url}, 额外请求头={list(headers) or '无'}")
+        return self._client
+
+    def _get_batcher(self) -> Optional[CompletionBatcher]:
+        window_ms = _float_env("OPENAI_COMPAT_BATCH_WINDOW_MS", 0.0)
+        if window_ms <= 0:
+            return None
+        max_batch = int(_float_env("OPENAI_COMPAT_MAX_BATCH_SIZE", 8))
+        if (self._batcher is None or self._batcher.window_seconds != window_ms / 1000
+                or self._batcher.max_batch_size != max_batch):
+            self._batcher = CompletionBatcher(self, window_ms / 1000, max_batch)
+        return self._batcher
+
+    def map_model(self, model: str) -> str:
+        return _json_env("OPENAI_COMPAT_MODEL_MAP").get(model, model)
+
+    async def generate(self, messages, model, temperature, max_tokens, enable_web_search, session_id=None) -> str:
+        backend_model = self.map_model(model)
+        batcher = self._get_batcher()
+        try:
+            if batcher is not None:
+                return await batcher.submit(backend_model, render_chatml(messages), temperature, max_tokens,
+                                            session_id)
+            client = self.get_client()
+            started_at = time.monotonic()
+            response = await client.chat.completions.create(model=backend_model, messages=messages,
+                                                            temperature=temperature, max_tokens=max_tokens)
+            LLMInterface._record_usage(self.name, backend_model, session_id, response, started_at)
+            return response.choices[0].message.content or ""
+        except Exception as e:
+            logger.exception(f"OpenAI 兼容服务调用失败 (model: {backend_model}): {e}")
+            raise ProviderCallError(f"AI服务 (openai_compat) 调用失败: {str(e)}")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            try:
+                await self._client.close()
+            finally:
+                self._client = None
+                self._client_config = None
@@ -0,0 +1,162 @@
+import os
+import time
+from bisect import bisect_left
+from loguru import logger
+from typing import Dict, List, Optional, Any
+
+# --- 运行时性能指标 ---
+# 所有指标都保存在固定大小的环形时间片中 (默认 10 秒一片，共 90 片 = 15 分钟)：
+# 记录一次只更新当前时间片，查询只遍历固定数量的时间片，开销与流量大小无关。
+# 指标只在事件循环线程中更新，不加锁；偶发的并发更新最多造成计数上的微小误差。
+
+SLOT_SECONDS = 10
+SLOT_COUNT = 90
+WINDOW_MINUTES = (1, 5, 15)
+
+# 延迟直方图的桶上界 (毫秒)：1ms 起按 1.3 倍递增到约 2 分钟
+LATENCY_BUCKETS_MS: List[float] = []
+_bound = 1.0
+while _bound < 120000:
+    LATENCY_BUCKETS_MS.append(round(_bound, 1))
+    _bound *= 1.3
+
+
+class SlidingWindowCounter:
+    """按时间片滚动的计数器"""
+
+    def __init__(self, slot_seconds: int = SLOT_SECONDS, slot_count: int = SLOT_COUNT):
+        self.slot_seconds = slot_seconds
+        self.slot_count = slot_count
+        self._counts = [0] * slot_count
+        self._epochs = [-1] * slot_count
+
+    def _slot(self, now: float) -> int:
+        epoch = int(now // self.slot_seconds)
+        index = epoch % self.slot_count
+        if self._epochs[index] != epoch:
+            self._epochs[index] = epoch
+            self._counts[index] = 0
+        return index
+
+    def add(self, amount: int = 1, now: Optional[float] = None) -> None:
+        self._counts[self._slot(time.monotonic() if now is None else now)] += amount
+
+    def total(self, seconds: float, now: Optional[float] = None) -> int:
+        current = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        oldest = current - max(1, int(seconds // self.slot_seconds)) + 1
+        return sum(count for count, epoch in zip(self._counts, self._epochs) if oldest <= epoch <= current)
+
+
+class SlidingWindowHistogram:
+    """按时间片滚动的延迟直方图，分位数取所在桶的上界"""
+
+    def __init__(self, slot_seconds: int = SLOT_SECONDS, slot_count: int = SLOT_COUNT):
+        self.slot_seconds = slot_seconds
+        self.slot_count = slot_count
+        self._buckets = [[0] * (len(LATENCY_BUCKETS_MS) + 1) for _ in range(slot_count)]
+        self._epochs = [-1] * slot_count
+
+    def record(self, latency_ms: float, now: Optional[float] = None) -> None:
+        epoch = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        index = epoch % self.slot_count
+        buckets = self._buckets[index]
+        if self._epochs[index] != epoch:
+            self._epochs[index] = epoch
+            for i in range(len(buckets)):
+                buckets[i] = 0
+        buckets[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def percentiles(self, seconds: float, pcts: tuple = (50, 95), now: Optional[float] = None) -> List[int]:
+        current = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        oldest = current - max(1, int(seconds // self.slot_seconds)) + 1
+        merged = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for buckets, epoch in zip(self._buckets, self._epochs):
+            if oldest <= epoch <= current:
+                for i, count in enumerate(buckets):
+                    merged[i] += count
+        total = sum(merged)
+        results = []
+        for pct in pcts:
+            if total == 0:
+                results.append(0)
+                continue
+            target = total * pct / 100
+            running = 0
+            for i, count in enumerate(merged):
+                running += count
+                if running >= target:
+                    results.append(int(LATENCY_BUCKETS_MS[min(i, len(LATENCY_BUCKETS_MS) - 1)]))
+                    break
+        return results
+
+
+class PerfMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.llm_latency: Dict[str, SlidingWindowHistogram] = {}
+        self.llm_calls: Dict[str, SlidingWindowCounter] = {}
+        self.llm_errors: Dict[str, SlidingWindowCounter] = {}
+        self.cache_lookups: Dict[str, SlidingWindowCounter] = {}
+        self.cache_hits: Dict[str, SlidingWindowCounter] = {}
+
+    # --- 记录 ---
+    def record_llm_call(self, provider: str, latency_seconds: float, error: bool = False) -> None:
+        if provider not in self.llm_calls:
+            self.llm_latency[provider] = SlidingWindowHistogram()
+            self.llm_calls[provider] = SlidingWindowCounter()
+            self.llm_errors[provider] = SlidingWindowCounter()
+        now = time.monotonic()
+        self.llm_latency[provider].record(latency_seconds * 1000, now)
+        self.llm_calls[provider].add(1, now)
+        if error:
+            self.llm_errors[provider].add(1, now)
+
+    def record_cache(self, name: str, hits: int, lookups: int = 1) -> None:
+        """记录缓存命中，lookups 可以是查找次数，也可以是 token 数等其他单位"""
+        if name not in self.cache_lookups:
+            self.cache_lookups[name] = SlidingWindowCounter()
+            self.cache_hits[name] = SlidingWindowCounter()
+        now = time.monotonic()
+        self.cache_lookups[name].add(lookups, now)
+        self.cache_hits[name].add(hits, now)
+
+    # --- 查询 ---
+    def llm_summary(self, seconds: float) -> List[Dict[str, Any]]:
+        rows = []
+        for provider, calls in self.llm_calls.items():
+            p50, p95 = self.llm_latency[provider].percentiles(seconds, (50, 95))
+            error_rates = {}
+            for minutes in WINDOW_MINUTES:
+                total = calls.total(minutes * 60)
+                error_rates[minutes] = self.llm_errors[provider].total(minutes * 60) / total if total else 0.0
+            rows.append({"provider": provider, "calls": calls.total(seconds),
+                         "errors": self.llm_errors[provider].total(seconds), "p50_ms": p50, "p95_ms": p95,
+                         "error_rates": error_rates})
+        return rows
+
+    def cache_summary(self, seconds: float) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name, lookups in self.cache_lookups.items():
+            total = lookups.total(seconds)
+            hits = self.cache_hits[name].total(seconds)
+            result[name] = {"lookups": total, "hits": hits, "hit_rate": hits / total if total else 0.0}
+        return result
+
+
+def current_rss_mb() -> float:
+    """当前进程常驻内存 (MB)。Linux 下读取 /proc/self/statm，其他平台退化为峰值 RSS。"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 下单位为 KB
+    except Exception as e:
+        logger.debug(f"[perf_metrics] 读取进程内存失败: {e}")
+        return 0.0
+
+
+# 全局单例
+perf_metrics = PerfMetrics()
@@ -2,10 +2,22 @@ import asyncio
 import os
 import json
 import time
+import tempfile
 from loguru import logger
 from typing import List, Dict, Any, Optional
 
-from .llm_api import LLMInterface # 确保 llm_api.py 在同一目录下或正确配置的包路径下
+from .llm_api import LLMInterface, close_provider_clients # 确保 llm_api.py 在同一目录下或正确配置的包路径下
+from .lifecycle import lifecycle
+from .usage_stats import usage_recorder
+from .knowledge_base import knowledge_base
+from .scheduler import scheduler, priority_class_for, PRIORITY_CLASSES
+from .perf_metrics import perf_metrics, current_rss_mb, WINDOW_MINUTES
+from .traffic_recorder import traffic_recorder
+from .history_retention import SessionStore, SessionIndex, HistoryRetentionService, export_sessions
+from .query_router import route_message, TIER_LIGHT, TIER_FULL
+from .search_gate import (decide_web_search, set_session_search_mode, get_session_search_mode,
+                          global_search_enabled, SEARCH_MODE_COMMAND_PATTERN, SEARCH_MODE_AUTO, SEARCH_MODE_ON,
+                          SEARCH_MODE_OFF)
 
 # 获取数据目录路径
 # __file__ 是当前脚本 (qq_bot.py) 的路径
@@ -13,10 +25,13 @@ from .llm_api import LLMInterface # 确保 llm_api.py 在同一目录下或正
 # os.path.dirname(os.path.dirname(__file__)) 是 plugins/ 的上一级目录 (即项目根目录)
 PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(PROJECT_ROOT_DIR, "data")
-CHAT_HISTORY_DIR = os.path.join(DATA_DIR, "chat_history")
+# QQBOT_CHAT_HISTORY_DIR 可把会话历史放到其他目录 (tools/replay_traffic.py 用它把回放隔离在临时目录中)
+CHAT_HISTORY_DIR = os.getenv("QQBOT_CHAT_HISTORY_DIR") or os.path.join(DATA_DIR, "chat_history")
+# 管理员 "导出历史" 命令的输出目录，同样可用 QQBOT_EXPORT_DIR 改到其他目录
+EXPORT_DIR = os.getenv("QQBOT_EXPORT_DIR") or os.path.join(DATA_DIR, "exports")
 
-# 存储对话历史的字典，键为用户ID，值为消息列表
-user_sessions: Dict[str, List[Dict[str, str]]] = {}
+# 存储对话历史的字典，键为用户ID，值为消息列表 (同时维护消息总数，见 SessionStore)
+user_sessions: SessionStore = SessionStore()
 
 # --- 从环境变量读取配置，并提供默认值 ---
 # 系统提示词
@@ -30,57 +45,97 @@ try:
 except ValueError:
     logger.warning(f"环境变量 QQBOT_MAX_HISTORY_LENGTH 的值 '{os.getenv('QQBOT_MAX_HISTORY_LENGTH')}' 不是有效的整数，将使用默认值 10。")
     MAX_HISTORY_LENGTH = 10
+
+# 会话写回缓存: >0 时 save_user_session 只把会话标记为脏，延迟这么多秒后批量落盘 (退出时由 lifecycle 统一落盘)
+try:
+    SESSION_WRITE_BEHIND_SECONDS = float(os.getenv("QQBOT_SESSION_WRITE_BEHIND_SECONDS", "0"))
+except ValueError:
+    logger.warning(f"环境变量 QQBOT_SESSION_WRITE_BEHIND_SECONDS 的值 '{os.getenv('QQBOT_SESSION_WRITE_BEHIND_SECONDS')}' 无效，将关闭写回缓存。")
+    SESSION_WRITE_BEHIND_SECONDS = 0.0
 # --- 配置读取结束 ---
 
+# 待落盘的会话 (仅写回缓存模式使用)
+dirty_sessions: set = set()
+# 正在处理消息的会话 -> 进行中的处理数
+active_sessions: Dict[str, int] = {}
+_dirty_flush_handle: Optional[asyncio.TimerHandle] = None
+
+# 会话索引: 记录各会话文件的最后写入时间与消息数，启动时按索引加载，不再遍历目录
+history_index = SessionIndex(CHAT_HISTORY_DIR)
+
+def _load_session_file(user_id: str) -> bool:
+    """加载单个会话文件到内存，返回文件是否存在"""
+    file_path = os.path.join(CHAT_HISTORY_DIR, f"{user_id}.json")
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            session_data = json.load(f)
+            # 校验并可能更新 system prompt
+            if not session_data or not isinstance(session_data, list) or not session_data[0].get("role") == "system":
+                logger.warning(f"用户 {user_id} 的历史记录格式不正确或缺少系统提示，将重新初始化。")
+                user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
+            elif session_data[0].get("content") != SYSTEM_PROMPT:
+                logger.info(f"用户 {user_id} 的系统提示词与当前配置不同，将使用新的系统提示词更新会话。")
+                session_data[0]["content"] = SYSTEM_PROMPT
+                user_sessions[user_id] = session_data
+            else:
+                user_sessions[user_id] = session_data
+    except FileNotFoundError:
+        logger.warning(f"会话索引中的用户 {user_id} 的历史文件 {file_path} 不存在，已从索引中移除。")
+        history_index.forget(user_id)
+        return False
+    except json.JSONDecodeError:
+        logger.error(f"解析用户 {user_id} 的会话历史文件 {file_path} 失败 (JSON格式错误)，将为此用户创建新会话。")
+        user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    except Exception as e:
+        logger.error(f"加载用户 {user_id} 的会话历史时出错 ({file_path}): {e}，将为此用户创建新会话。")
+        user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    return True
+
 # 加载用户会话历史
 def load_user_sessions():
-    """从文件加载所有用户的会话历史"""
-    global user_sessions
-
+    """按会话索引加载所有用户的会话历史；索引不存在时 (首次升级) 扫描一次目录并建立索引"""
     if not os.path.exists(CHAT_HISTORY_DIR):
         os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
         logger.info(f"聊天历史目录 {CHAT_HISTORY_DIR} 已创建。")
         return
 
     logger.info(f"开始从 {CHAT_HISTORY_DIR} 加载用户会话历史...")
+    rebuilt = not history_index.load()
+    user_ids = history_index.rebuild() if rebuilt else history_index.session_ids()
     loaded_count = 0
-    for filename in os.listdir(CHAT_HISTORY_DIR):
-        if filename.endswith('.json'):
-            user_id = filename[:-5] # 移除 '.json' 后缀
-            file_path = os.path.join(CHAT_HISTORY_DIR, filename)
-
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    session_data = json.load(f)
-                    # 校验并可能更新 system prompt
-                    if not session_data or not isinstance(session_data, list) or not session_data[0].get("role") == "system":
-                        logger.warning(f"用户 {user_id} 的历史记录格式不正确或缺少系统提示，将重新初始化。")
-                        user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
-                    elif session_data[0].get("content") != SYSTEM_PROMPT:
-                        logger.info(f"用户 {user_id} 的系统提示词与当前配置不同，将使用新的系统提示词更新会话。")
-                        session_data[0]["content"] = SYSTEM_PROMPT
-                        user_sessions[user_id] = session_data
-                    else:
-                        user_sessions[user_id] = session_data
-                    loaded_count += 1
-            except json.JSONDecodeError:
-                logger.error(f"解析用户 {user_id} 的会话历史文件 {file_path} 失败 (JSON格式错误)，将为此用户创建新会话。")
-                user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
-            except Exception as e:
-                logger.error(f"加载用户 {user_id} 的会话历史时出错 ({file_path}): {e}，将为此用户创建新会话。")
-                user_sessions[user_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for user_id in user_ids:
+        if _load_session_file(user_id):
+            loaded_count += 1
+            if rebuilt:
+                history_index.touch(user_id, len(user_sessions[user_id]),
+                                    history_index.sessions.get(user_id, {}).get("updated_at"))
+    if rebuilt:
+        history_index.save()
     if loaded_count > 0:
         logger.info(f"成功加载了 {loaded_count} 个用户的会话历史。")
     else:
         logger.info("未找到任何已保存的用户会话历史文件。")
 
-# 保存用户会话历史到文件
-def save_user_session(user_id: str):
-    """将用户会话历史保存到文件"""
-    if user_id not in user_sessions:
-        logger.warning(f"尝试保存用户 {user_id} 的会话历史，但该用户不在内存中。")
-        return
+def rebuild_session_index():
+    """
+    异常退出后的恢复：索引可能没来得及保存，扫描目录重建索引，并加载索引中遗漏的会话。
+    """
+    loaded = 0
+    for user_id in history_index.rebuild():
+        if user_id not in user_sessions and _load_session_file(user_id):
+            loaded += 1
+        if user_id in user_sessions:
+            history_index.touch(user_id, len(user_sessions[user_id]),
+                                history_index.sessions.get(user_id, {}).get("updated_at"))
+    history_index.save()
+    logger.info(f"会话索引重建完成，补充加载 {loaded} 个会话。")
 
+# 保存用户会话历史到文件
+def _write_session_file(user_id: str, session: List[Dict[str, str]]):
+    """
+    原子地写入会话文件：先写临时文件再替换，进程崩溃时不会留下写了一半的 JSON。
+    临时文件名 <user_id>.<随机串>.json.tmp 每次写入都不同，事件循环线程与后台落盘线程同时写同一会话时互不覆盖。
+    """
     if not os.path.exists(CHAT_HISTORY_DIR):
         try:
             os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
@@ -90,21 +145,164 @@ def save_user_session(user_id: str):
             return
 
     file_path = os.path.join(CHAT_HISTORY_DIR, f"{user_id}.json")
+    tmp_path = None
 
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(user_sessions[user_id], f, ensure_ascii=False, indent=2)
+        fd, tmp_path = tempfile.mkstemp(dir=CHAT_HISTORY_DIR, prefix=f"{user_id}.", suffix=".json.tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, file_path)
+        history_index.touch(user_id, len(session))
     except Exception as e:
         logger.error(f"保存用户 {user_id} 的会话历史到 {file_path} 时出错: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def save_user_session(user_id: str):
+    """将用户会话历史保存到文件。开启写回缓存时只标记为脏，稍后批量落盘。"""
+    if user_id not in user_sessions:
+        logger.warning(f"尝试保存用户 {user_id} 的会话历史，但该用户不在内存中。")
+        return
+
+    if SESSION_WRITE_BEHIND_SECONDS > 0:
+        dirty_sessions.add(user_id)
+        _schedule_dirty_flush()
+        return
+
+    _write_session_file(user_id, user_sessions[user_id])
+
+def _take_dirty_snapshot() -> Dict[str, List[Dict[str, str]]]:
+    """在事件循环线程上复制待落盘的会话，避免写文件时会话仍在被修改"""
+    snapshot = {uid: list(user_sessions[uid]) for uid in dirty_sessions if uid in user_sessions}
+    dirty_sessions.clear()
+    return snapshot
+
+def _write_snapshot(snapshot: Dict[str, List[Dict[str, str]]]):
+    for uid, session in snapshot.items():
+        _write_session_file(uid, session)
+    if snapshot:
+        logger.debug(f"[save_user_session] 写回缓存已落盘 {len(snapshot)} 个会话。")
+
+def flush_dirty_sessions() -> int:
+    """同步落盘所有脏会话，返回落盘数量。退出时由 lifecycle 调用。"""
+    global _dirty_flush_handle
+    if _dirty_flush_handle is not None:
+        _dirty_flush_handle.cancel()
+        _dirty_flush_handle = None
+    snapshot = _take_dirty_snapshot()
+    _write_snapshot(snapshot)
+    return len(snapshot)
+
+def _flush_dirty_in_background():
+    global _dirty_flush_handle
+    _dirty_flush_handle = None
+    snapshot = _take_dirty_snapshot()
+    if snapshot:
+        asyncio.get_running_loop().run_in_executor(None, _write_snapshot, snapshot)
+
+def _schedule_dirty_flush():
+    global _dirty_flush_handle
+    if _dirty_flush_handle is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_dirty_sessions()  # 不在事件循环中 (如独立脚本)，直接落盘
+        return
+    _dirty_flush_handle = loop.call_later(SESSION_WRITE_BEHIND_SECONDS, _flush_dirty_in_background)
+
+def recover_session_temp_files():
+    """
+    异常退出后的恢复：处理写入过程中遗留的 <user_id>.<随机串>.json.tmp 文件 (兼容旧版的 <user_id>.json.tmp)。
+    同一会话只取最新的一个完整可解析的临时文件，且仅当它比正式文件新时才替换正式文件并载入内存；
+    其余临时文件 (损坏的、更旧的) 一律删除。
+    """
+    if not os.path.exists(CHAT_HISTORY_DIR):
+        return
+    candidates: Dict[str, List[tuple]] = {}
+    for filename in os.listdir(CHAT_HISTORY_DIR):
+        if not filename.endswith('.json.tmp'):
+            continue
+        tmp_path = os.path.join(CHAT_HISTORY_DIR, filename)
+        # mkstemp 的随机串不含 '.'，去掉最后一段即为 user_id；旧版文件名没有随机串
+        user_id = filename[:-len('.json.tmp')].rsplit('.', 1)[0]
+        try:
+            mtime = os.path.getmtime(tmp_path)
+        except OSError:
+            continue
+        candidates.setdefault(user_id, []).append((mtime, tmp_path))
+
+    recovered = removed = 0
+    for user_id, tmp_files in candidates.items():
+        file_path = os.path.join(CHAT_HISTORY_DIR, f"{user_id}.json")
+        current_mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else 0
+        done = False
+        for mtime, tmp_path in sorted(tmp_files, reverse=True):
+            if not done and mtime > current_mtime:
+                try:
+                    with open(tmp_path, 'r', encoding='utf-8') as f:
+                        session_data = json.load(f)
+                    if isinstance(session_data, list) and session_data and session_data[0].get("role") == "system":
+                        os.replace(tmp_path, file_path)
+                        user_sessions[user_id] = session_data
+                        history_index.touch(user_id, len(session_data))
+                        recovered += 1
+                        done = True
+                        continue
+                except Exception:
+                    pass
+            try:
+                os.remove(tmp_path)
+                removed += 1
+            except Exception as e:
+                logger.error(f"删除会话临时文件 {tmp_path} 失败: {e}")
+    logger.info(f"会话临时文件恢复完成: 恢复 {recovered} 个，删除损坏或过期的 {removed} 个。")
 
 # 初始化时加载会话历史
 load_user_sessions()
 
-async def process_message_content(user_id: str, message_text: str) -> Optional[str]:
+# 聊天历史后台维护: 归档长期未活跃的会话、截断过长的会话文件 (第一次处理消息时启动)
+try:
+    HISTORY_MAX_MESSAGES_ON_DISK = int(os.getenv("QQBOT_HISTORY_MAX_MESSAGES_ON_DISK", str(MAX_HISTORY_LENGTH)))
+except ValueError:
+    HISTORY_MAX_MESSAGES_ON_DISK = MAX_HISTORY_LENGTH
+retention_service = HistoryRetentionService(history_index, user_sessions, dirty_sessions, active_sessions,
+                                            _write_session_file, HISTORY_MAX_MESSAGES_ON_DISK)
+
+# 注册退出时的落盘/关闭操作与异常退出后的恢复操作
+lifecycle.register_recovery_hook("会话临时文件恢复", recover_session_temp_files)
+lifecycle.register_recovery_hook("会话索引重建", rebuild_session_index)
+lifecycle.register_close_hook("LLM 客户端连接池", close_provider_clients)
+lifecycle.register_close_hook("聊天历史后台维护", retention_service.stop)
+lifecycle.register_flush_hook("脏会话", flush_dirty_sessions)
+lifecycle.register_flush_hook("会话索引", history_index.save)
+lifecycle.register_flush_hook("用量统计", usage_recorder.flush)
+lifecycle.register_flush_hook("流量录制", traffic_recorder.flush)
+
+def is_admin(sender_id: Optional[str]) -> bool:
+    """判断消息发送者是否为 .env 中配置的管理员 ROOT"""
+    root_qq = os.getenv("ROOT")
+    return bool(sender_id) and bool(root_qq) and str(sender_id) == str(root_qq)
+
+async def process_message_content(user_id: str, message_text: str, sender_id: Optional[str] = None) -> Optional[str]:
     """
     处理用户消息内容，包括命令处理和与LLM交互。
     由 bot.py 中的 NcatBot 消息处理器调用。
+    user_id 为会话标识 (private_xxx / group_xxx)，sender_id 为实际发送者QQ号，用于管理员命令鉴权。
     """
+    # 处理期间记录会话正在使用，后台维护不会归档或卸载这些会话
+    active_sessions[user_id] = active_sessions.get(user_id, 0) + 1
+    try:
+        return await _process_message_content(user_id, message_text, sender_id)
+    finally:
+        active_sessions[user_id] -= 1
+        if active_sessions[user_id] <= 0:
+            del active_sessions[user_id]
+
+async def _process_message_content(user_id: str, message_text: str, sender_id: Optional[str]) -> Optional[str]:
     logger.info(f"[process_message_content] 用户 {user_id} | 消息: '{message_text[:100]}...'")
     message_text = message_text.strip()
 
@@ -112,12 +310,35 @@ async def process_message_content(user_id: str, message_text: str) -> Optional[s
         logger.info(f"[process_message_content] 用户 {user_id} | 消息内容为空，忽略。")
         return None
 
+    retention_service.ensure_started()
+
     if message_text.lower() == "清除会话":
         logger.info(f"[process_message_content] 用户 {user_id} | 检测到清除会话命令。")
         return await handle_clear_session(user_id)
     elif message_text.lower() in ["帮助", "help"]:
         logger.info(f"[process_message_content] 用户 {user_id} | 检测到帮助命令。")
         return await handle_help()
+    elif message_text.startswith("用量统计") and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 查询用量统计。")
+        return await handle_usage_stats(message_text[len("用量统计"):].strip())
+    elif message_text.startswith("搜索统计") and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 查询联网搜索统计。")
+        return await handle_search_stats(message_text[len("搜索统计"):].strip())
+    elif message_text.startswith("诊断") and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 查询运行诊断。")
+        return await handle_diagnostics(message_text[len("诊断"):].strip())
+    elif message_text.startswith("导出历史") and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 导出聊天历史。")
+        return await handle_export_history(message_text[len("导出历史"):].strip())
+    elif message_text == "调度统计" and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 查询调度统计。")
+        return await handle_scheduler_stats()
+    elif message_text.startswith("知识库") and is_admin(sender_id):
+        logger.info(f"[process_message_content] 用户 {user_id} | 管理员 {sender_id} 管理知识库。")
+        return await handle_knowledge_base(message_text[len("知识库"):].strip())
+    elif SEARCH_MODE_COMMAND_PATTERN.match(message_text):
+        logger.info(f"[process_message_content] 用户 {user_id} | 检测到联网搜索设置命令。")
+        return await handle_search_mode(user_id, message_text[len("联网搜索"):].strip())
 
     if user_id not in user_sessions:
         logger.info(f"[process_message_content] 用户 {user_id} | 初始化新会话。")
@@ -128,7 +349,7 @@ async def process_message_content(user_id: str, message_text: str) -> Optional[s
         logger.info(f"[process_message_content] 用户 {user_id} | 系统提示词已更改，更新当前会话的系统提示。")
         user_sessions[user_id][0]["content"] = SYSTEM_PROMPT
 
-    user_sessions[user_id].append({"role": "user", "content": message_text})
+    user_sessions.append_message(user_id, {"role": "user", "content": message_text})
 
     if len(user_sessions[user_id]) > MAX_HISTORY_LENGTH + 1:
         logger.info(f"[process_message_content] 用户 {user_id} | 会话历史 ({len(user_sessions[user_id])}条) 超出限制 ({MAX_HISTORY_LENGTH + 1}条)，进行截断。")
@@ -137,18 +358,53 @@ async def process_message_content(user_id: str, message_text: str) -> Optional[s
         user_sessions[user_id] = [system_message] + recent_messages
         logger.debug(f"[process_message_content] 用户 {user_id} | 截断后会话长度: {len(user_sessions[user_id])}")
 
+    history = user_sessions[user_id][:-1]
+    # 先查本地知识库：高置信度的 FAQ 命中直接回答，不调用大模型
     try:
-        response = await LLMInterface.generate_response(
-            messages=user_sessions[user_id]
-        )
+        if not knowledge_base.loaded:
+            # 启动预热尚未完成时，在线程中等待加载，不在事件循环上读盘建索引
+            await asyncio.get_running_loop().run_in_executor(None, knowledge_base.ensure_loaded)
+        kb_result = knowledge_base.lookup(message_text)
+    except Exception as e:
+        logger.warning(f"[process_message_content] 用户 {user_id} | 知识库检索失败，跳过: {e}")
+        kb_result = {"mode": "none"}
+    perf_metrics.record_cache("knowledge_base", 0 if kb_result["mode"] == "none" else 1)
+    if kb_result["mode"] == "direct":
+        logger.info(f"[process_message_content] 用户 {user_id} | 知识库直接命中 (置信度 {kb_result['confidence']})，跳过LLM调用。")
+        response = kb_result["answer"]
+        _append_assistant_reply(user_id, response)
+        return response
+
+    messages = user_sessions[user_id]
+    if kb_result["mode"] == "context":
+        # 参考资料只注入本次请求，不写入会话历史
+        logger.info(f"[process_message_content] 用户 {user_id} | 知识库部分命中 (置信度 {kb_result['confidence']})，注入参考资料。")
+        messages = history + [
+            {"role": "system", "content": f"以下是管理员提供的参考资料，如与问题相关请优先据此回答:\n{kb_result['context']}"},
+            user_sessions[user_id][-1],
+        ]
+
+    route = route_message(message_text, history, session_id=user_id)
+    # 联网判断对每条消息都执行：简短的时效性问题 (如 "今天天气怎么样") 会被分到 light 档，
+    # 需要联网时改走 full 档，使用默认模型与参数
+    route["enable_web_search"] = decide_web_search(user_id, message_text, history)
+    if route["enable_web_search"] and route["tier"] == TIER_LIGHT:
+        logger.info(f"[process_message_content] 用户 {user_id} | 消息需要联网搜索，由 '{TIER_LIGHT}' 档改走 '{TIER_FULL}' 档。")
+        route.update({"tier": TIER_FULL, "model": None, "max_tokens": None})
+
+    try:
+        # 只有大模型调用占用调度名额，命令与知识库直接回答不排队
+        async with scheduler.slot(user_id, priority_class_for(user_id, sender_id)):
+            response = await LLMInterface.generate_response(
+                messages=messages,
+                model=route["model"],
+                max_tokens=route["max_tokens"],
+                enable_web_search=route["enable_web_search"],
+                session_id=user_id
+            )
 
         if response:
-            user_sessions[user_id].append({"role": "assistant", "content": response})
-            if len(user_sessions[user_id]) > MAX_HISTORY_LENGTH + 1: # 再次检查
-                system_message = user_sessions[user_id][0]
-                recent_messages = user_sessions[user_id][-(MAX_HISTORY_LENGTH):]
-                user_sessions[user_id] = [system_message] + recent_messages
-            save_user_session(user_id)
+            _append_assistant_reply(user_id, response)
         else:
             logger.warning(f"[process_message_content] 用户 {user_id} | LLM未返回有效内容。")
         return response
@@ -156,6 +412,15 @@ async def process_message_content(user_id: str, message_text: str) -> Optional[s
         logger.exception(f"[process_message_content] 用户 {user_id} | 处理消息时调用LLM出错: {e}")
         return f"抱歉，处理您的消息时内部出现了错误: {str(e)}"
 
+def _append_assistant_reply(user_id: str, response: str):
+    """把回答追加到会话历史，超出 MAX_HISTORY_LENGTH 时再次截断，然后保存"""
+    user_sessions.append_message(user_id, {"role": "assistant", "content": response})
+    if len(user_sessions[user_id]) > MAX_HISTORY_LENGTH + 1: # 再次检查
+        system_message = user_sessions[user_id][0]
+        recent_messages = user_sessions[user_id][-(MAX_HISTORY_LENGTH):]
+        user_sessions[user_id] = [system_message] + recent_messages
+    save_user_session(user_id)
+
 async def handle_clear_session(user_id: str) -> str:
     logger.info(f"[handle_clear_session] 用户 {user_id} | 处理清除会话命令。")
     if user_id in user_sessions:
@@ -169,6 +434,188 @@ async def handle_clear_session(user_id: str) -> str:
         save_user_session(user_id)
         return "没有找到您的会话历史，已为您初始化新会话。"
 
+async def handle_usage_stats(args: str) -> str:
+    """
+    管理员命令: 用量统计 [天数] [group|private]
+    列出最近若干天 token 消耗最多的会话。
+    """
+    days = 1
+    scope = "all"
+    for arg in args.split():
+        if arg.isdigit():
+            days = max(1, min(int(arg), 90))
+        elif arg.lower() in ("group", "private", "群", "私聊"):
+            scope = {"群": "group", "私聊": "private"}.get(arg, arg.lower())
+    try:
+        # 查询涉及磁盘IO，放到线程中执行，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        top = await loop.run_in_executor(None, usage_recorder.top_consumers, days, 10, scope)
+        totals = await loop.run_in_executor(None, usage_recorder.daily_totals, days)
+    except Exception as e:
+        logger.exception(f"[handle_usage_stats] 查询用量统计失败: {e}")
+        return f"查询用量统计失败: {e}"
+
+    if not top:
+        return f"最近 {days} 天没有用量记录。"
+    lines = [f"最近 {days} 天 Token 消耗 Top {len(top)} ({scope}):"]
+    for i, row in enumerate(top, 1):
+        lines.append(
+            f"{i}. {row['session_id']}: 调用 {row['calls']} 次, 输入 {row['prompt_tokens']}"
+            f" (缓存 {row['cached_tokens']}), 输出 {row['completion_tokens']}, 平均耗时 {row['avg_latency_ms']}ms"
+        )
+    lines.append("按天汇总:")
+    for row in totals:
+        lines.append(
+            f"- {row['day']}: 调用 {row['calls']} 次, 输入 {row['prompt_tokens']}, 输出 {row['completion_tokens']}"
+        )
+    return "\n".join(lines)
+
+async def handle_search_mode(user_id: str, args: str) -> str:
+    """会话命令: 联网搜索 [开|关|自动]，不带参数时显示当前设置"""
+    modes = {"开": SEARCH_MODE_ON, "开启": SEARCH_MODE_ON, "on": SEARCH_MODE_ON,
+             "关": SEARCH_MODE_OFF, "关闭": SEARCH_MODE_OFF, "off": SEARCH_MODE_OFF,
+             "自动": SEARCH_MODE_AUTO, "auto": SEARCH_MODE_AUTO}
+    labels = {SEARCH_MODE_ON: "始终开启", SEARCH_MODE_OFF: "始终关闭", SEARCH_MODE_AUTO: "自动判断"}
+    if not args:
+        current = labels[get_session_search_mode(user_id)]
+        suffix = "" if global_search_enabled() else " (全局已关闭联网搜索)"
+        return f"当前会话的联网搜索设置: {current}{suffix}。可发送 \"联网搜索 开/关/自动\" 修改。"
+    mode = modes.get(args.lower())
+    if mode is None:
+        return "用法: 联网搜索 开/关/自动"
+    set_session_search_mode(user_id, mode)
+    logger.info(f"[handle_search_mode] 用户 {user_id} | 联网搜索设置为 {mode}。")
+    return f"当前会话的联网搜索已设置为: {labels[mode]}。"
+
+async def handle_search_stats(args: str) -> str:
+    """管理员命令: 搜索统计 [天数]，按消息对比开启/关闭联网搜索时的耗时与 token 消耗"""
+    days = max(1, min(int(args), 90)) if args.isdigit() else 7
+    try:
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, usage_recorder.search_comparison, days, "zhipu")
+    except Exception as e:
+        logger.exception(f"[handle_search_stats] 查询联网搜索统计失败: {e}")
+        return f"查询联网搜索统计失败: {e}"
+    if not rows:
+        return f"最近 {days} 天没有智谱调用记录。"
+    lines = [f"最近 {days} 天智谱 联网搜索 开/关 对比 (按消息统计，含失败与后备调用):"]
+    for row in rows:
+        lines.append(
+            f"- 联网{'开启' if row['web_search'] else '关闭'}: 消息 {row['messages']} 条 (失败 {row['failures']}),"
+            f" API 调用 {row['calls']} 次 (平均每条 {row['avg_calls']} 次), 平均耗时 {row['avg_latency_ms']}ms"
+            f" (最大 {row['max_latency_ms']}ms), 平均输入 {row['avg_prompt_tokens']}, 平均输出 {row['avg_completion_tokens']}"
+        )
+    return "\n".join(lines)
+
+async def handle_diagnostics(args: str) -> str:
+    """
+    管理员命令: 诊断 [分钟]，默认统计最近 5 分钟 (可选 1/5/15)。
+    只读取内存中的滑动窗口指标与计数器，不经过 LLM 调用路径，也不读写磁盘。
+    """
+    minutes = int(args) if args.isdigit() and int(args) in WINDOW_MINUTES else 5
+    seconds = minutes * 60
+    uptime_minutes = int((time.time() - perf_metrics.started_at) // 60)
+    lines = [f"运行诊断 (最近 {minutes} 分钟, 已运行 {uptime_minutes // 60} 小时 {uptime_minutes % 60} 分钟):"]
+
+    lines.append(f"- 进行中的处理: {lifecycle.in_flight}{'' if lifecycle.accepting else ' (正在退出，已停止接收新消息)'}")
+    if scheduler.enabled:
+        depths = scheduler.queue_depths()
+        lines.append(f"- 调度队列: 处理中 {scheduler.running}/{scheduler.max_concurrency},"
+                     f" 排队 管理员 {depths['admin']} / 私聊 {depths['private']} / 群@ {depths['group']}")
+    else:
+        lines.append("- 调度队列: 未启用")
+
+    lines.append(f"- 会话: 内存中 {len(user_sessions)} 个 (共 {user_sessions.message_count} 条消息), 待落盘 {len(dirty_sessions)} 个,"
+                 f" 进程内存 {current_rss_mb():.1f} MB")
+
+    history_stats = history_index.stats()
+    last_run = retention_service.last_run
+    lines.append(f"- 聊天历史: 磁盘上 {history_stats['sessions']} 个会话, 已归档 {history_stats['archived']} 个"
+                 + (f", 上次维护归档 {last_run['archived']} 个 / 截断 {last_run['trimmed']} 个" if last_run else ""))
+
+    llm_rows = perf_metrics.llm_summary(seconds)
+    if not llm_rows:
+        lines.append("- LLM 调用: 暂无记录")
+    for row in llm_rows:
+        rates = " / ".join(f"{m}分钟 {row['error_rates'][m]:.0%}" for m in WINDOW_MINUTES)
+        lines.append(f"- LLM {row['provider']}: 调用 {row['calls']} 次, 失败 {row['errors']} 次,"
+                     f" 耗时 p50 {row['p50_ms']}ms / p95 {row['p95_ms']}ms; 错误率 {rates}")
+
+    cache_labels = {"knowledge_base": "知识库命中率", "prompt_cache": "提示词缓存命中率 (按输入 token)"}
+    for name, row in perf_metrics.cache_summary(seconds).items():
+        lines.append(f"- {cache_labels.get(name, name)}: {row['hit_rate']:.0%} ({row['hits']}/{row['lookups']})")
+    return "\n".join(lines)
+
+async def handle_export_history(args: str) -> str:
+    """
+    管理员命令: 导出历史 [天数]，把最近若干天活跃过的会话 (含归档) 流式导出到 EXPORT_DIR (默认 data/exports/) 下的 jsonl.gz 文件。
+    不带天数时导出全部。导出在线程池中进行，不阻塞消息处理。
+    """
+    days = int(args) if args.isdigit() else 0
+    since = time.time() - days * 86400 if days > 0 else None
+    output_path = os.path.join(EXPORT_DIR, f"chat_history-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+    try:
+        loop = asyncio.get_running_loop()
+        # 先落盘写回缓存中的会话与索引，保证导出内容是最新的：快照在事件循环中获取，写盘放到线程池
+        snapshot = _take_dirty_snapshot()
+        await loop.run_in_executor(None, _write_snapshot, snapshot)
+        await loop.run_in_executor(None, history_index.save)
+        count = await loop.run_in_executor(None, export_sessions, CHAT_HISTORY_DIR, output_path, True, since)
+    except Exception as e:
+        logger.exception(f"[handle_export_history] 导出聊天历史失败: {e}")
+        return f"导出聊天历史失败: {e}"
+    scope = f"最近 {days} 天" if days > 0 else "全部"
+    return f"已导出{scope}的 {count} 个会话到 {os.path.relpath(output_path, PROJECT_ROOT_DIR)}。"
+
+async def handle_scheduler_stats() -> str:
+    """管理员命令: 调度统计，查看各优先级类别的排队情况与等待耗时分位数"""
+    if not scheduler.enabled:
+        return "优先级调度未启用 (QQBOT_SCHEDULER_MAX_CONCURRENCY=0，不限并发)。"
+    snapshot = scheduler.snapshot()
+    labels = {"admin": "管理员", "private": "私聊", "group": "群@"}
+    lines = [f"调度统计 (并发上限 {scheduler.max_concurrency}, 当前处理中 {scheduler.running}, 耗时为最近 15 分钟):"]
+    for priority_class in PRIORITY_CLASSES:
+        row = snapshot[priority_class]
+        lines.append(
+            f"- {labels[priority_class]}: 排队 {row['waiting']}, 已处理 {row['dispatched']} (超时提前放行 {row['promoted']}),"
+            f" 等待 p50/p95/p99 {row['wait_p50_ms']}/{row['wait_p95_ms']}/{row['wait_p99_ms']}ms,"
+            f" 处理 p50/p95 {row['service_p50_ms']}/{row['service_p95_ms']}ms"
+        )
+    return "\n".join(lines)
+
+async def handle_knowledge_base(args: str) -> str:
+    """
+    管理员命令:
+      知识库添加 问题 | 答案
+      知识库删除 <编号>
+      知识库更新        重新索引 data/knowledge_base/docs 中新增或修改的文档
+      知识库状态
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        if args.startswith("添加"):
+            question, sep, answer = args[len("添加"):].partition("|")
+            if not sep or not question.strip() or not answer.strip():
+                return "用法: 知识库添加 问题 | 答案"
+            faq_id = await loop.run_in_executor(None, knowledge_base.add_faq, question.strip(), answer.strip())
+            return f"已添加 FAQ #{faq_id}。"
+        elif args.startswith("删除"):
+            faq_id = args[len("删除"):].strip()
+            removed = await loop.run_in_executor(None, knowledge_base.remove_faq, faq_id)
+            return f"已删除 FAQ #{faq_id}。" if removed else f"未找到 FAQ #{faq_id}。"
+        elif args.startswith("更新"):
+            summary = await loop.run_in_executor(None, knowledge_base.refresh_documents)
+            return f"知识库文档已更新: {summary}。"
+        elif args.startswith("状态") or not args:
+            await loop.run_in_executor(None, knowledge_base.ensure_loaded)
+            stats = knowledge_base.stats()
+            return (f"知识库状态: FAQ {stats['faq']} 条, 文档 {stats['documents']} 个"
+                    f" (片段 {stats['chunks']} 个), 索引词 {stats['terms']} 个。")
+    except Exception as e:
+        logger.exception(f"[handle_knowledge_base] 知识库操作失败: {e}")
+        return f"知识库操作失败: {e}"
+    return "用法: 知识库添加 问题 | 答案 / 知识库删除 <编号> / 知识库更新 / 知识库状态"
+
 async def handle_help() -> str:
     logger.info(f"[handle_help] 处理帮助命令。")
     help_text = f"""
@@ -177,6 +624,7 @@ QQ机器人指令帮助：
 2. 群聊中@我并发送问题。
 3. 发送 "清除会话" 可以清除当前对话的历史记录。
 4. 发送 "帮助" 或 "help" 查看此帮助信息。
+5. 发送 "联网搜索 开/关/自动" 设置当前会话是否联网搜索 (默认自动判断)。
 
 当前对话设置：
 - 系统提示词: "{SYSTEM_PROMPT[:50]}..."
@@ -0,0 +1,150 @@
+import os
+import re
+from loguru import logger
+from typing import List, Dict, Any, Optional
+
+# --- 查询分级路由 ---
+# 在调用 LLMInterface.generate_response 之前，用纯本地的启发式规则判断消息复杂度：
+# 有简单消息正面证据 (问候、寒暄) 的消息走 "light" 档 (更便宜的模型、小 max_tokens、不联网；调用方判断需要联网时会改走 full 档)，
+# 其余消息 (包括 "写个周报" 这类短小的任务请求) 一律走 "full" 档 (沿用 .env / config.py 中的默认模型与参数)。
+# 所有配置均在调用时从环境变量读取，因为 bot.py 会在导入插件之后才把 config.py 的值写入环境变量。
+
+TIER_LIGHT = "light"
+TIER_FULL = "full"
+
+DEFAULT_LIGHT_MAX_TOKENS = 512
+DEFAULT_SIMPLE_MAX_CHARS = 20
+
+_GREETING_PATTERN = re.compile(
+    r"^(你好|您好|嗨|哈喽|hi|hello|hey|在吗|在不在|早|早上好|早安|中午好|下午好|晚上好|晚安|谢谢|多谢|感谢|thanks|thank you|"
+    r"好的|好|嗯|嗯嗯|ok|okay|收到|哈哈+|hh+|666+|拜拜|再见|bye)[呀啊呢哦吖\s!！~～。.?？]*$",
+    re.IGNORECASE
+)
+_CODE_PATTERN = re.compile(
+    r"```|\bdef |\bclass |\bimport |\breturn\b|#include|console\.log|SELECT .+ FROM|=>|[{};]\s*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_COMPLEX_KEYWORDS = (
+    "为什么", "如何", "怎么实现", "怎么做", "原理", "解释", "分析", "比较", "对比", "区别", "总结", "翻译",
+    "写一", "编写", "代码", "程序", "报错", "错误", "bug", "算法", "证明", "推导", "计算", "详细", "步骤",
+    "方案", "优化", "设计", "论文", "润色", "改写", "规划",
+)
+# 寒暄/情绪类短句：没有明确任务，简短回应即可
+_SMALL_TALK_PATTERN = re.compile(
+    r"^(今天|最近|真的|有点)?(吃了吗|吃饭了吗|在干嘛|在干什么|干嘛呢|你是谁|你叫什么|你几岁|好累啊?|好困啊?|好无聊啊?|无聊|"
+    r"哈哈.*|嘿嘿.*|呜呜.*|666.*|牛啊?|厉害|太棒了|真好|不错|好吧|行吧|可以|没事|算了|加油|辛苦了)[呀啊呢哦吖\s!！~～。.?？]*$",
+    re.IGNORECASE
+)
+# 请求动词：带有明确任务，答案长度不可预期
+_REQUEST_VERBS = ("写个", "写一", "帮我", "帮忙", "讲讲", "说说", "怎么", "怎样", "如何", "教我", "给我", "生成", "列出", "介绍")
+# 英文技术名词 (编程语言、工具等)。中文字符也属于 \w，不能用 \b 判断边界
+_TECH_TERM_PATTERN = re.compile(
+    r"(?<![a-z0-9])(python|java|javascript|typescript|c\+\+|cpp|c#|golang|rust|php|sql|mysql|redis|linux|shell|bash|"
+    r"docker|k8s|git|api|http|html|css|json|regex|vue|react|node|excel|latex|matlab)(?![a-z0-9])",
+    re.IGNORECASE
+)
+_FOLLOW_UP_KEYWORDS = ("继续", "接着", "然后呢", "展开", "详细点", "具体点", "再说说", "还有呢", "为什么")
+_URL_PATTERN = re.compile(r"https?://", re.IGNORECASE)
+
+
+def _router_enabled() -> bool:
+    return os.getenv("QQBOT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"[query_router] 环境变量 {name} 的值 '{value}' 不是有效整数，使用默认值 {default}。")
+        return default
+
+
+def classify_message(message_text: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    """
+    根据消息特征为消息打分，返回 {"tier", "score", "reasons"}。
+    只有存在简单消息的正面证据 (问候、寒暄) 使 score < 0 时才判定为 light，其余一律为 full，
+    避免 "帮我写个快排" 这类短小但需要长回答的请求被 light 档的 max_tokens 截断。不做任何网络请求。
+    """
+    text = message_text.strip()
+    simple_max_chars = _int_env("LLM_ROUTER_SIMPLE_MAX_CHARS", DEFAULT_SIMPLE_MAX_CHARS)
+    score = 0
+    reasons: List[str] = []
+
+    if _GREETING_PATTERN.match(text):
+        score -= 2
+        reasons.append("greeting")
+    elif _SMALL_TALK_PATTERN.match(text):
+        score -= 1
+        reasons.append("small-talk")
+
+    length = len(text)
+    if length > simple_max_chars:
+        score += 1
+        reasons.append(f"len>{simple_max_chars}")
+    if length > 200:
+        score += 2
+        reasons.append("len>200")
+    if "\n" in text:
+        score += 1
+        reasons.append("multiline")
+
+    if _CODE_PATTERN.search(text):
+        score += 3
+        reasons.append("code")
+    if _URL_PATTERN.search(text):
+        score += 1
+        reasons.append("url")
+
+    keyword_hits = [kw for kw in _COMPLEX_KEYWORDS if kw in text.lower()]
+    if keyword_hits:
+        score += min(len(keyword_hits), 3)
+        reasons.append("keywords:" + ",".join(keyword_hits[:3]))
+    verb_hits = [verb for verb in _REQUEST_VERBS if verb in text]
+    if verb_hits:
+        score += 1
+        reasons.append("request:" + ",".join(verb_hits[:3]))
+    tech_match = _TECH_TERM_PATTERN.search(text)
+    if tech_match:
+        score += 1
+        reasons.append(f"tech:{tech_match.group(0).lower()}")
+
+    # 简短的追问依赖上一轮回答的上下文，上一轮是长回答时仍然交给完整档位
+    if history and length <= simple_max_chars and any(kw in text for kw in _FOLLOW_UP_KEYWORDS):
+        last_assistant = next((m for m in reversed(history) if m.get("role") == "assistant"), None)
+        if last_assistant and len(last_assistant.get("content", "")) > 300:
+            score += 2
+            reasons.append("follow-up")
+
+    tier = TIER_LIGHT if score < 0 else TIER_FULL
+    return {"tier": tier, "score": score, "reasons": reasons}
+
+
+def route_message(message_text: str, history: Optional[List[Dict[str, str]]] = None,
+                  session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    为一条消息选择模型档位，返回可直接传给 LLMInterface.generate_response 的参数:
+    {"tier", "model", "max_tokens", "enable_web_search"}。
+    full 档的各项为 None，表示沿用 llm_api.py 中的默认决策。
+    """
+    if not _router_enabled():
+        return {"tier": TIER_FULL, "model": None, "max_tokens": None, "enable_web_search": None}
+
+    decision = classify_message(message_text, history)
+    if decision["tier"] == TIER_LIGHT:
+        route = {
+            "tier": TIER_LIGHT,
+            "model": os.getenv("LLM_LIGHT_MODEL") or None,
+            "max_tokens": _int_env("LLM_LIGHT_MAX_TOKENS", DEFAULT_LIGHT_MAX_TOKENS),
+            "enable_web_search": False,
+        }
+    else:
+        route = {"tier": TIER_FULL, "model": None, "max_tokens": None, "enable_web_search": None}
+
+    logger.info(
+        f"[query_router] 会话 {session_id} | 路由到 '{route['tier']}' 档 (score={decision['score']}, "
+        f"依据={decision['reasons'] or '无'}, model={route['model'] or '默认'}, max_tokens={route['max_tokens'] or '默认'})"
+    )
+    return route
@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from loguru import logger
+from typing import Deque, Dict, List, Optional, Any
+
+from .perf_metrics import SlidingWindowHistogram
+
+# --- 消息优先级调度 ---
+# 需要调用大模型的消息在调用前经过这里排队，同时进行的大模型调用数不超过 QQBOT_SCHEDULER_MAX_CONCURRENCY。
+# 命令 (诊断、帮助等) 与知识库直接回答不占用名额，上游拥堵时仍能立即响应。
+# 默认为 0 (不限并发、不排队，与引入调度前的行为一致)：异步提供商本身可以并发处理大量请求，
+# 只有在上游有并发/速率限制 (如免费额度、自建推理服务) 需要主动限流时，才设置为正数启用按优先级排队。
+# 排队顺序采用按会话的加权公平队列 (自时钟 SCFQ)：每个会话是一条流，流的权重由优先级类别决定
+# (管理员 > 私聊 > 群@)，同一个刷屏的群只能占用自己那一份额度，不会把其他会话挤到队尾。
+# 等待超过 QQBOT_SCHEDULER_MAX_WAIT_SECONDS 的消息会被提前放行，避免低优先级消息被饿死。
+
+CLASS_ADMIN = "admin"
+CLASS_PRIVATE = "private"
+CLASS_GROUP = "group"
+PRIORITY_CLASSES = (CLASS_ADMIN, CLASS_PRIVATE, CLASS_GROUP)
+
+# 各类别的流权重：权重越大，同样一条消息推进的虚拟时间越少，越早被调度
+CLASS_WEIGHTS = {CLASS_ADMIN: 16.0, CLASS_PRIVATE: 4.0, CLASS_GROUP: 1.0}
+
+try:
+    SCHEDULER_MAX_CONCURRENCY = int(os.getenv("QQBOT_SCHEDULER_MAX_CONCURRENCY", "0"))
+except ValueError:
+    SCHEDULER_MAX_CONCURRENCY = 0
+try:
+    SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("QQBOT_SCHEDULER_MAX_WAIT_SECONDS", "10"))
+except ValueError:
+    SCHEDULER_MAX_WAIT_SECONDS = 10.0
+
+
+def priority_class_for(session_id: str, sender_id: Optional[str] = None) -> str:
+    """管理员 (.env 中的 ROOT) 发出的消息为 admin，其余按会话类型分为 private / group"""
+    root_qq = os.getenv("ROOT")
+    if sender_id and root_qq and str(sender_id) == str(root_qq):
+        return CLASS_ADMIN
+    return CLASS_PRIVATE if session_id.startswith("private_") else CLASS_GROUP
+
+
+class _Ticket:
+    __slots__ = ("flow", "priority_class", "finish_tag", "enqueued_at", "started_at", "future", "state")
+
+    def __init__(self, flow: str, priority_class: str, finish_tag: float, future: Optional[asyncio.Future]):
+        self.flow = flow
+        self.priority_class = priority_class
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.started_at = 0.0
+        self.future = future
+        self.state = "waiting"  # waiting / running / done / cancelled
+
+
+class _ClassStats:
+    __slots__ = ("waits", "services", "dispatched", "promoted", "waiting")
+
+    def __init__(self):
+        self.waits = SlidingWindowHistogram()
+        self.services = SlidingWindowHistogram()
+        self.dispatched = 0
+        self.promoted = 0
+        self.waiting = 0
+
+
+class PriorityScheduler:
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+                 max_wait_seconds: float = SCHEDULER_MAX_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self.running = 0
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[str, float] = {}
+        self._heap: List[Any] = []  # (finish_tag, seq, ticket)
+        self._arrivals: Deque[_Ticket] = deque()  # 按到达顺序，用于防饿死检查
+        self._seq = itertools.count()
+        self._last_promoted = False
+        self._stats: Dict[str, _ClassStats] = {c: _ClassStats() for c in PRIORITY_CLASSES}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {c: s.waiting for c, s in self._stats.items()}
+
+    # --- 排队与放行 ---
+    def _next_finish_tag(self, flow: str, priority_class: str) -> float:
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        finish = start + 1.0 / CLASS_WEIGHTS.get(priority_class, 1.0)
+        self._flow_finish[flow] = finish
+        return finish
+
+    def _start(self, ticket: _Ticket) -> None:
+        ticket.state = "running"
+        ticket.started_at = time.monotonic()
+        self._virtual_time = max(self._virtual_time, ticket.finish_tag)
+        self.running += 1
+        stats = self._stats[ticket.priority_class]
+        stats.dispatched += 1
+        stats.waits.record((ticket.started_at - ticket.enqueued_at) * 1000, ticket.started_at)
+
+    def _pop_next(self) -> Optional[_Ticket]:
+        # 防饿死：最早到达的消息等待过久时，不论权重直接放行。
+        # 持续过载时最多每隔一个名额提前放行一次，其余名额仍按权重分配，高优先级消息不会退化为先到先得。
+        while self._arrivals and self._arrivals[0].state != "waiting":
+            self._arrivals.popleft()
+        if (not self._last_promoted and self._arrivals
+                and time.monotonic() - self._arrivals[0].enqueued_at >= self.max_wait_seconds):
+            ticket = self._arrivals.popleft()
+            self._stats[ticket.priority_class].promoted += 1
+            self._last_promoted = True
+            logger.debug("[scheduler] {} ({}) 等待超过 {:.0f} 秒，提前放行。", ticket.flow, ticket.priority_class,
+                         self.max_wait_seconds)
+            return ticket
+        self._last_promoted = False
+        while self._heap:
+            _, _, ticket = heapq.heappop(self._heap)
+            if ticket.state == "waiting":
+                return ticket
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_concurrency:
+            ticket = self._pop_next()
+            if ticket is None:
+                break
+            self._stats[ticket.priority_class].waiting -= 1
+            self._start(ticket)
+            if ticket.future is not None and not ticket.future.done():
+                ticket.future.set_result(None)
+        if self.running == 0 and not any(s.waiting for s in self._stats.values()):
+            self._heap.clear()
+            self._arrivals.clear()
+            # 空闲时清理已落后于虚拟时间的流记录，避免会话数增长导致字典无限膨胀
+            self._flow_finish = {f: t for f, t in self._flow_finish.items() if t > self._virtual_time}
+
+    async def acquire(self, flow: str, priority_class: str) -> _Ticket:
+        finish_tag = self._next_finish_tag(flow, priority_class)
+        if self.running < self.max_concurrency and not any(s.waiting for s in self._stats.values()):
+            ticket = _Ticket(flow, priority_class, finish_tag, None)
+            self._start(ticket)
+            return ticket
+        ticket = _Ticket(flow, priority_class, finish_tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (finish_tag, next(self._seq), ticket))
+        self._arrivals.append(ticket)
+        self._stats[priority_class].waiting += 1
+        if self.running < self.max_concurrency:
+            self._dispatch()
+        logger.debug("[scheduler] {} ({}) 进入队列，当前运行 {} / 排队 {}", flow, priority_class, self.running,
+                     len(self._heap))
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.state == "running":
+                self.release(ticket)  # 已被放行但调用方被取消，归还名额
+            elif ticket.state == "waiting":
+                ticket.state = "cancelled"
+                self._stats[priority_class].waiting -= 1
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        if ticket.state != "running":
+            return
+        ticket.state = "done"
+        self.running -= 1
+        now = time.monotonic()
+        self._stats[ticket.priority_class].services.record((now - ticket.started_at) * 1000, now)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, priority_class: str):
+        """包裹一次大模型调用：按优先级排队获得处理名额，结束后归还"""
+        if not self.enabled:
+            yield
+            return
+        ticket = await self.acquire(session_id, priority_class)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    # --- 统计 ---
+    def snapshot(self, seconds: float = 900) -> Dict[str, Dict[str, Any]]:
+        """各优先级类别的排队数、已调度数、被提前放行数，以及最近一段时间内等待/处理耗时分位数 (毫秒)"""
+        result = {}
+        for priority_class, stats in self._stats.items():
+            wait_p50, wait_p95, wait_p99 = stats.waits.percentiles(seconds, (50, 95, 99))
+            service_p50, service_p95 = stats.services.percentiles(seconds, (50, 95))
+            result[priority_class] = {
+                "waiting": stats.waiting,
+                "dispatched": stats.dispatched,
+                "promoted": stats.promoted,
+                "wait_p50_ms": wait_p50,
+                "wait_p95_ms": wait_p95,
+                "wait_p99_ms": wait_p99,
+                "service_p50_ms": service_p50,
+                "service_p95_ms": service_p95,
+            }
+        return result
+
+
+# 全局单例
+scheduler = PriorityScheduler()
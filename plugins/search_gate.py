@@ -0,0 +1,156 @@
+import os
+import re
+from datetime import datetime
+from loguru import logger
+from typing import List, Dict, Any, Optional, Tuple
+
+# --- 联网搜索意图判断 ---
+# 智谱 web_search 工具每次调用都会增加一次 search_pro 检索的耗时与费用，且检索无结果时还会触发第二次无搜索调用。
+# 这里用本地规则判断一条消息是否真的需要实时信息，只在需要时才为本次调用开启联网搜索。
+
+SEARCH_MODE_AUTO = "auto"
+SEARCH_MODE_ON = "on"
+SEARCH_MODE_OFF = "off"
+
+# 会话命令 "联网搜索 [开|关|自动]"：只匹配完整命令，"联网搜索一下北京天气" 这类提问不算命令
+SEARCH_MODE_COMMAND_PATTERN = re.compile(r"^联网搜索(\s+(开|开启|on|关|关闭|off|自动|auto))?\s*$", re.IGNORECASE)
+
+# 会话级覆盖: session_id -> on/off，未设置即为 auto
+session_search_modes: Dict[str, str] = {}
+
+# 时间词与时效性话题各计 1 分，单独出现不足以联网 ("今天好累啊"、"价格太离谱了")，
+# 需要与另一类信号 (提问句式、实体、明确要求) 同时出现，如 "北京今天天气怎么样"
+_TIME_KEYWORDS = (
+    "今天", "今日", "现在", "目前", "当前", "最新", "最近", "近期", "今年", "昨天", "明天", "本周", "这周", "下周",
+    "本月", "这个月", "实时", "刚刚",
+)
+_REALTIME_TOPIC_KEYWORDS = (
+    "天气", "气温", "新闻", "热搜", "头条", "股价", "股票", "汇率", "油价", "金价", "比分", "赛果", "赛程", "票房",
+    "价格", "多少钱", "报价", "上映", "发布会", "发售", "开售", "放假", "几号", "星期几",
+)
+# 明确要求检索
+_EXPLICIT_SEARCH_KEYWORDS = ("搜一下", "搜索", "查一下", "查查", "帮我查", "联网", "百度", "谷歌", "google", "官网", "链接")
+# 事实型提问句式
+_FACT_QUESTION_PATTERN = re.compile(r"(谁是|是谁|在哪|哪里|哪儿|什么时候|何时|多少|几点|几月|哪一年|哪家|排名|第几)")
+# 询问某个人物 ("谁是梅西")，排除 "你是谁" 这类寒暄
+_PERSON_QUESTION_PATTERN = re.compile(r"谁是(?![你我他她它])\S|(?<![你我他她它们])是谁")
+# 简短追问的句式 ("那上海呢")，用于沿用上一轮的联网判断
+_FOLLOW_UP_QUESTION_PATTERN = re.compile(r"(呢|吗|么|[?？])\s*$")
+# 实体特征：书名号、带版本号的产品名、英文专有名词
+_ENTITY_PATTERN = re.compile(r"《[^》]+》|[A-Za-z]+\s?\d+(\.\d+)?\s?(pro|max|ultra|plus)?\b|\b[A-Z][a-zA-Z]{2,}\b")
+_YEAR_PATTERN = re.compile(r"(20\d{2})\s*年?")
+# 不需要检索的闲聊/创作类请求
+_NO_SEARCH_KEYWORDS = ("写一", "编写", "翻译", "润色", "改写", "代码", "程序", "讲个笑话", "写诗", "作文", "解释一下这段")
+
+_SEARCH_THRESHOLD = 2
+
+
+def global_search_enabled() -> bool:
+    """GLM_ENABLE_WEB_SEARCH=false 时全局关闭联网搜索，会话覆盖也不能开启"""
+    return os.getenv("GLM_ENABLE_WEB_SEARCH", "true").lower() in ("1", "true", "yes", "on")
+
+
+def detect_search_intent(message_text: str, history: Optional[List[Dict[str, str]]] = None) -> Tuple[bool, List[str]]:
+    """根据关键词、句式、实体和上下文为消息打分，返回 (是否需要联网, 命中的依据)"""
+    text = message_text.strip()
+    lowered = text.lower()
+    score = 0
+    reasons: List[str] = []
+
+    time_hits = [kw for kw in _TIME_KEYWORDS if kw in text]
+    if time_hits:
+        score += 1
+        reasons.append("time:" + ",".join(time_hits[:3]))
+    topic_hits = [kw for kw in _REALTIME_TOPIC_KEYWORDS if kw in text]
+    if topic_hits:
+        score += 1
+        reasons.append("topic:" + ",".join(topic_hits[:3]))
+    if any(kw in lowered for kw in _EXPLICIT_SEARCH_KEYWORDS):
+        score += 3
+        reasons.append("explicit")
+    if _FACT_QUESTION_PATTERN.search(text):
+        score += 1
+        reasons.append("fact-question")
+    if _PERSON_QUESTION_PATTERN.search(text):
+        score += 1
+        reasons.append("person")
+    if _ENTITY_PATTERN.search(text):
+        score += 1
+        reasons.append("entity")
+    year_match = _YEAR_PATTERN.search(text)
+    if year_match and int(year_match.group(1)) >= datetime.now().year - 1:
+        score += 2
+        reasons.append("recent-year")
+    if any(kw in text for kw in _NO_SEARCH_KEYWORDS):
+        score -= 2
+        reasons.append("creative")
+
+    # 简短追问沿用上一轮的话题：上一条用户消息需要联网时，本条也倾向联网
+    if score < _SEARCH_THRESHOLD and history and len(text) <= 15 and _FOLLOW_UP_QUESTION_PATTERN.search(text):
+        last_user = next((m for m in reversed(history) if m.get("role") == "user"), None)
+        # 上一条消息不带历史判断，避免递归回溯整段对话
+        if last_user and detect_search_intent(last_user.get("content", ""), None)[0]:
+            score = max(score, _SEARCH_THRESHOLD)
+            reasons.append("context")
+
+    return score >= _SEARCH_THRESHOLD, reasons
+
+
+def decide_web_search(session_id: str, message_text: str,
+                      history: Optional[List[Dict[str, str]]] = None) -> bool:
+    """结合全局开关、会话覆盖与意图判断，决定本次调用是否开启联网搜索"""
+    if not global_search_enabled():
+        return False
+    mode = session_search_modes.get(session_id, SEARCH_MODE_AUTO)
+    if mode == SEARCH_MODE_ON:
+        logger.info(f"[search_gate] 会话 {session_id} | 联网搜索被会话设置强制开启。")
+        return True
+    if mode == SEARCH_MODE_OFF:
+        logger.info(f"[search_gate] 会话 {session_id} | 联网搜索被会话设置强制关闭。")
+        return False
+    need_search, reasons = detect_search_intent(message_text, history)
+    logger.info(f"[search_gate] 会话 {session_id} | 联网搜索: {'开启' if need_search else '关闭'} (依据={reasons or '无'})")
+    return need_search
+
+
+def set_session_search_mode(session_id: str, mode: str) -> None:
+    if mode == SEARCH_MODE_AUTO:
+        session_search_modes.pop(session_id, None)
+    else:
+        session_search_modes[session_id] = mode
+
+
+def get_session_search_mode(session_id: str) -> str:
+    return session_search_modes.get(session_id, SEARCH_MODE_AUTO)
+
+
+# --- 意图判断样例 (python -m plugins.search_gate 检查，调整关键词或分值后运行，防止闲聊重新触发联网) ---
+_INTENT_EXAMPLES = [
+    # (消息, 上一条用户消息, 期望是否联网)
+    ("今天好累啊", None, False),
+    ("最近怎么样", None, False),
+    ("你现在在干嘛", None, False),
+    ("价格太离谱了哈哈", None, False),
+    ("目前为止都挺好", None, False),
+    ("你是谁", None, False),
+    ("我不太懂股票", None, False),
+    ("帮我写一首关于今天天气的诗", None, False),
+    ("哈哈", "北京今天天气怎么样？", False),
+    ("北京今天天气怎么样？", None, True),
+    ("今天有什么新闻", None, True),
+    ("最新的iPhone多少钱", None, True),
+    ("谁是梅西", None, True),
+    ("搜一下Python 3.13的新特性", None, True),
+    ("那上海呢", "北京今天天气怎么样？", True),
+]
+
+if __name__ == "__main__":
+    failures = 0
+    for text, previous, expected in _INTENT_EXAMPLES:
+        history = [{"role": "user", "content": previous}] if previous else None
+        actual, reasons = detect_search_intent(text, history)
+        mark = "OK " if actual == expected else "ERR"
+        failures += actual != expected
+        print(f"{mark} {text!r}: 期望 {expected}, 实际 {actual} (依据={reasons or '无'})")
+    print(f"{len(_INTENT_EXAMPLES) - failures}/{len(_INTENT_EXAMPLES)} 通过")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from loguru import logger
+from typing import List, Dict, Any, Optional
+
+# --- 线上流量录制 (用于性能回归测试) ---
+# QQBOT_RECORD_TRAFFIC=true 时，把进入 bot.py 处理器的消息事件与每次 LLM 调用的耗时/用量
+# 按时间顺序写入 data/recordings/traffic-<时间>.jsonl.gz，之后可用 tools/replay_traffic.py 回放。
+# 匿名化：群号/QQ号按本次录制独有的随机盐做哈希映射为数字 (同一次录制内保持一致，不同录制之间无法关联)；
+# 消息默认只记录长度，QQBOT_RECORD_INCLUDE_TEXT=true 时才保存原文。
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(PROJECT_ROOT_DIR, "data")
+RECORDINGS_DIR = os.path.join(DATA_DIR, "recordings")
+RECORDING_FORMAT_VERSION = 1
+
+# 管理员在录制中固定映射为这个 QQ 号，回放时把 ROOT 设为它即可复现管理员优先级
+REPLAY_ADMIN_ID = 1
+
+# 累计多少条事件后在后台线程追加写入一次 (每次写入是一个独立的 gzip 成员，gzip.open 可连续读取)
+RECORD_FLUSH_EVENTS = 200
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+class TrafficRecorder:
+    def __init__(self, recordings_dir: str = RECORDINGS_DIR):
+        self.recordings_dir = recordings_dir
+        self.enabled = _env_flag("QQBOT_RECORD_TRAFFIC")
+        self.include_text = _env_flag("QQBOT_RECORD_INCLUDE_TEXT")
+        self.path: Optional[str] = None
+        self._salt = secrets.token_bytes(16)
+        self._started_at = time.monotonic()
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_thread: Optional[threading.Thread] = None
+        if self.enabled:
+            self.path = os.path.join(recordings_dir, f"traffic-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+            self._pending.append({"type": "meta", "version": RECORDING_FORMAT_VERSION,
+                                  "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                  "include_text": self.include_text})
+            logger.info(f"[traffic_recorder] 流量录制已开启 (保存原文: {self.include_text})，写入 {self.path}")
+
+    def anonymize_id(self, raw_id: Any) -> int:
+        """把群号/QQ号映射为本次录制内稳定的匿名数字 ID"""
+        root_qq = os.getenv("ROOT")
+        if root_qq and str(raw_id) == str(root_qq):
+            return REPLAY_ADMIN_ID
+        digest = hashlib.sha256(self._salt + str(raw_id).encode("utf-8")).digest()
+        return 1_000_000 + int.from_bytes(digest[:6], "big") % 9_000_000_000
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        event["t"] = round(time.monotonic() - self._started_at, 3)
+        with self._lock:
+            self._pending.append(event)
+            should_flush = len(self._pending) >= RECORD_FLUSH_EVENTS
+        if should_flush:
+            self._flush_in_background()
+
+    # --- 录制 ---
+    def record_message(self, kind: str, target_id: Any, user_id: Any, text: str, at_me: bool = True) -> None:
+        """记录一条进入处理器的消息。kind 为 group / private，target_id 为群号或私聊对象QQ号"""
+        if not self.enabled:
+            return
+        event = {"type": "message", "kind": kind, "target": self.anonymize_id(target_id),
+                 "user": self.anonymize_id(user_id), "at_me": at_me, "len": len(text)}
+        if self.include_text:
+            event["text"] = text
+        self._append(event)
+
+    def record_llm(self, session_id: Optional[str], provider: str, model: str, latency_ms: int,
+                   prompt_tokens: int, completion_tokens: int, cached_tokens: int, web_search: bool) -> None:
+        """记录一次 LLM 调用的耗时与用量，会话 ID 中的群号/QQ号同样做匿名化"""
+        if not self.enabled:
+            return
+        if session_id and "_" in session_id:
+            prefix, raw_id = session_id.split("_", 1)
+            session_id = f"{prefix}_{self.anonymize_id(raw_id)}"
+        self._append({"type": "llm", "session": session_id, "provider": provider, "model": model,
+                      "latency_ms": int(latency_ms), "prompt_tokens": prompt_tokens,
+                      "completion_tokens": completion_tokens, "cached_tokens": cached_tokens,
+                      "web_search": bool(web_search)})
+
+    # --- 落盘 ---
+    def _flush_in_background(self) -> None:
+        if self._flush_thread is not None and self._flush_thread.is_alive():
+            return
+        self._flush_thread = threading.Thread(target=self.flush, name="traffic-recorder-flush", daemon=True)
+        self._flush_thread.start()
+
+    def flush(self) -> int:
+        """把内存中的事件追加写入录制文件，返回写入条数"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            events, self._pending = self._pending, []
+        if not events:
+            return 0
+        payload = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in events)
+        with self._write_lock:
+            try:
+                os.makedirs(self.recordings_dir, exist_ok=True)
+                with gzip.open(self.path, "ab") as f:
+                    f.write(payload.encode("utf-8"))
+            except Exception as e:
+                logger.error(f"[traffic_recorder] 写入录制文件 {self.path} 失败，丢弃 {len(events)} 条事件: {e}")
+                return 0
+        return len(events)
+
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    """读取录制文件，返回按时间排序的事件列表 (不含 meta)"""
+    events = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                if event.get("type") != "meta":
+                    events.append(event)
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+# 全局单例
+traffic_recorder = TrafficRecorder()
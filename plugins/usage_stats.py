@@ -0,0 +1,325 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from loguru import logger
+from typing import List, Dict, Any, Optional, Tuple
+
+from .perf_metrics import perf_metrics
+from .traffic_recorder import traffic_recorder
+
+# 用量统计数据库位于项目根目录下的 data/ 中，与 chat_history 同级
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(PROJECT_ROOT_DIR, "data")
+USAGE_DB_PATH = os.path.join(DATA_DIR, "usage_stats.db")
+
+# 批量写入阈值：累计多少次调用或多少秒后落盘一次
+try:
+    USAGE_FLUSH_BATCH_SIZE = int(os.getenv("QQBOT_USAGE_FLUSH_BATCH_SIZE", "50"))
+except ValueError:
+    USAGE_FLUSH_BATCH_SIZE = 50
+try:
+    USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("QQBOT_USAGE_FLUSH_INTERVAL", "60"))
+except ValueError:
+    USAGE_FLUSH_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    web_search INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total INTEGER NOT NULL DEFAULT 0,
+    latency_ms_max INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, session_id, provider, model, web_search)
+)
+"""
+
+# 按消息的聚合：一条消息对应一次 generate_response，可能包含多次 API 调用
+_MESSAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_daily (
+    day TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    web_search INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total INTEGER NOT NULL DEFAULT 0,
+    latency_ms_max INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, provider, web_search)
+)
+"""
+
+_MESSAGE_UPSERT = """
+INSERT INTO message_daily (day, provider, web_search, messages, failures, latency_ms_total, latency_ms_max)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(day, provider, web_search) DO UPDATE SET
+    messages = messages + excluded.messages,
+    failures = failures + excluded.failures,
+    latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+    latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)
+"""
+
+_UPSERT = """
+INSERT INTO usage_daily (day, session_id, provider, model, web_search, calls, prompt_tokens,
+                         completion_tokens, cached_tokens, latency_ms_total, latency_ms_max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(day, session_id, provider, model, web_search) DO UPDATE SET
+    calls = calls + excluded.calls,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    cached_tokens = cached_tokens + excluded.cached_tokens,
+    latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+    latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)
+"""
+
+# 聚合键: (day, session_id, provider, model, web_search)
+_AggKey = Tuple[str, str, str, str, int]
+# 按消息的聚合键: (day, provider, web_search)
+_MessageKey = Tuple[str, str, int]
+
+
+def _read_field(obj: Any, name: str) -> Any:
+    """兼容 SDK 对象与 dict 两种形式的 usage 字段读取"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def extract_usage(usage: Any) -> Tuple[int, int, int]:
+    """
+    从各家 SDK 返回的 usage 对象中提取 (prompt_tokens, completion_tokens, cached_tokens)。
+    OpenAI/智谱 使用 prompt_tokens/completion_tokens，Claude 使用 input_tokens/output_tokens。
+    """
+    if usage is None:
+        return 0, 0, 0
+    prompt_tokens = _read_field(usage, "prompt_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = _read_field(usage, "input_tokens")
+    completion_tokens = _read_field(usage, "completion_tokens")
+    if completion_tokens is None:
+        completion_tokens = _read_field(usage, "output_tokens")
+    cached_tokens = _read_field(_read_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached_tokens is None:
+        cached_tokens = _read_field(usage, "cache_read_input_tokens")
+    return int(prompt_tokens or 0), int(completion_tokens or 0), int(cached_tokens or 0)
+
+
+class UsageRecorder:
+    """
+    LLM 调用用量记录器。
+    record() 只在内存中按 (天, 会话, 提供商, 模型, 是否联网) 累加，O(1) 且不做任何IO；
+    累计到一定次数或时间后，由后台线程一次性 UPSERT 到 SQLite 的日聚合表中。
+    """
+
+    def __init__(self, db_path: str = USAGE_DB_PATH, batch_size: int = USAGE_FLUSH_BATCH_SIZE,
+                 flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: Dict[_AggKey, List[int]] = {}
+        self._pending_messages: Dict[_MessageKey, List[int]] = {}  # [messages, failures, 耗时合计, 最大耗时]
+        self._pending_calls = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._schema_ready = False
+
+    def record(self, provider: str, model: str, session_id: Optional[str], prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0, latency_ms: int = 0,
+               web_search: bool = False) -> None:
+        key = (datetime.now().strftime("%Y-%m-%d"), session_id or "unknown", provider, model or "unknown",
+               1 if web_search else 0)
+        latency_ms = int(latency_ms)
+        with self._lock:
+            agg = self._pending.get(key)
+            if agg is None:
+                self._pending[key] = [1, prompt_tokens, completion_tokens, cached_tokens, latency_ms, latency_ms]
+            else:
+                agg[0] += 1
+                agg[1] += prompt_tokens
+                agg[2] += completion_tokens
+                agg[3] += cached_tokens
+                agg[4] += latency_ms
+                if latency_ms > agg[5]:
+                    agg[5] = latency_ms
+            self._pending_calls += 1
+            should_flush = (self._pending_calls >= self.batch_size or
+                            time.monotonic() - self._last_flush >= self.flush_interval)
+        if prompt_tokens > 0:
+            perf_metrics.record_cache("prompt_cache", cached_tokens, prompt_tokens)
+        traffic_recorder.record_llm(session_id, provider, model, latency_ms, prompt_tokens, completion_tokens,
+                                    cached_tokens, web_search)
+        if should_flush:
+            self._flush_in_background()
+
+    def record_message(self, provider: str, web_search: bool, latency_ms: int, failed: bool = False) -> None:
+        """记录一条消息 (一次 generate_response) 的端到端耗时，随 API 调用数据一起落盘"""
+        key = (datetime.now().strftime("%Y-%m-%d"), provider, 1 if web_search else 0)
+        latency_ms = int(latency_ms)
+        with self._lock:
+            agg = self._pending_messages.get(key)
+            if agg is None:
+                self._pending_messages[key] = [1, 1 if failed else 0, latency_ms, latency_ms]
+            else:
+                agg[0] += 1
+                agg[1] += 1 if failed else 0
+                agg[2] += latency_ms
+                if latency_ms > agg[3]:
+                    agg[3] = latency_ms
+
+    def _flush_in_background(self) -> None:
+        if self._flush_thread is not None and self._flush_thread.is_alive():
+            return  # 上一次落盘尚未结束，新数据留在内存中等待下一次
+        self._flush_thread = threading.Thread(target=self.flush, name="usage-stats-flush", daemon=True)
+        self._flush_thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            conn.execute(_SCHEMA)
+            conn.execute(_MESSAGE_SCHEMA)
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def flush(self) -> int:
+        """把内存中的聚合数据写入数据库，返回写入的调用次数。可在关闭时同步调用。"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                pending_messages, self._pending_messages = self._pending_messages, {}
+                calls, self._pending_calls = self._pending_calls, 0
+                self._last_flush = time.monotonic()
+            if not pending and not pending_messages:
+                return 0
+            rows = [key + tuple(agg) for key, agg in pending.items()]
+            message_rows = [key + tuple(agg) for key, agg in pending_messages.items()]
+            try:
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.executemany(_UPSERT, rows)
+                        conn.executemany(_MESSAGE_UPSERT, message_rows)
+                finally:
+                    conn.close()
+                logger.debug(f"[usage_stats] 已落盘 {calls} 次调用的用量数据 ({len(rows)} 行聚合)。")
+                return calls
+            except Exception as e:
+                logger.error(f"[usage_stats] 写入用量数据库 {self.db_path} 失败: {e}，数据放回内存等待重试。")
+                with self._lock:
+                    for key, agg in pending.items():
+                        cur = self._pending.get(key)
+                        if cur is None:
+                            self._pending[key] = agg
+                        else:
+                            for i in range(5):
+                                cur[i] += agg[i]
+                            cur[5] = max(cur[5], agg[5])
+                    for key, agg in pending_messages.items():
+                        cur = self._pending_messages.get(key)
+                        if cur is None:
+                            self._pending_messages[key] = agg
+                        else:
+                            for i in range(3):
+                                cur[i] += agg[i]
+                            cur[3] = max(cur[3], agg[3])
+                    self._pending_calls += calls
+                return 0
+
+    def top_consumers(self, days: int = 1, limit: int = 10, scope: str = "all") -> List[Dict[str, Any]]:
+        """
+        查询最近 days 天内 token 消耗最多的会话。
+        scope: "all" | "group" | "private"，按 session_id 前缀过滤。
+        """
+        self.flush()
+        since = datetime.fromtimestamp(time.time() - max(days - 1, 0) * 86400).strftime("%Y-%m-%d")
+        where = "day >= ?"
+        params: List[Any] = [since]
+        if scope in ("group", "private"):
+            where += " AND session_id LIKE ?"
+            params.append(f"{scope}\\_%")
+            where += " ESCAPE '\\'"
+        params.append(limit)
+        sql = (
+            "SELECT session_id, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens), SUM(cached_tokens), "
+            "SUM(latency_ms_total) FROM usage_daily WHERE " + where +
+            " GROUP BY session_id ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC LIMIT ?"
+        )
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "session_id": r[0], "calls": r[1], "prompt_tokens": r[2], "completion_tokens": r[3],
+                "cached_tokens": r[4], "avg_latency_ms": (r[5] // r[1]) if r[1] else 0,
+            }
+            for r in rows
+        ]
+
+    def daily_totals(self, days: int = 7) -> List[Dict[str, Any]]:
+        """按天汇总的总用量，用于观察趋势。"""
+        self.flush()
+        since = datetime.fromtimestamp(time.time() - max(days - 1, 0) * 86400).strftime("%Y-%m-%d")
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT day, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens), SUM(cached_tokens) "
+                "FROM usage_daily WHERE day >= ? GROUP BY day ORDER BY day", (since,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"day": r[0], "calls": r[1], "prompt_tokens": r[2], "completion_tokens": r[3], "cached_tokens": r[4]}
+            for r in rows
+        ]
+
+    def search_comparison(self, days: int = 7, provider: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        按消息对比开启/关闭联网搜索的平均耗时与平均 token 消耗。
+        一条消息的耗时包含失败重试与联网无结果后的后备调用，token 为该消息所有 API 调用之和。
+        """
+        self.flush()
+        since = datetime.fromtimestamp(time.time() - max(days - 1, 0) * 86400).strftime("%Y-%m-%d")
+        where = "day >= ?"
+        params: List[Any] = [since]
+        if provider:
+            where += " AND provider = ?"
+            params.append(provider)
+        conn = self._connect()
+        try:
+            calls = {r[0]: r[1:] for r in conn.execute(
+                "SELECT web_search, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens) FROM usage_daily "
+                "WHERE " + where + " GROUP BY web_search", params).fetchall()}
+            messages = conn.execute(
+                "SELECT web_search, SUM(messages), SUM(failures), SUM(latency_ms_total), MAX(latency_ms_max) "
+                "FROM message_daily WHERE " + where + " GROUP BY web_search ORDER BY web_search", params).fetchall()
+        finally:
+            conn.close()
+        result = []
+        for web_search, count, failures, latency_total, latency_max in messages:
+            api_calls, prompt_tokens, completion_tokens = calls.get(web_search, (0, 0, 0))
+            result.append({
+                "web_search": bool(web_search), "messages": count, "failures": failures, "calls": api_calls,
+                "avg_calls": round(api_calls / count, 2) if count else 0.0,
+                "avg_prompt_tokens": (prompt_tokens // count) if count else 0,
+                "avg_completion_tokens": (completion_tokens // count) if count else 0,
+                "avg_latency_ms": (latency_total // count) if count else 0,
+                "max_latency_ms": latency_max,
+            })
+        return result
+
+
+# 全局单例，供 llm_api.py 记录、qq_bot.py 查询
+usage_recorder = UsageRecorder()
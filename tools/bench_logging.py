@@ -0,0 +1,84 @@
+"""
+日志处理器吞吐量基准测试：按与 bot.py 相同的设置 (文件 + 控制台) 配置日志，分别测量两项优化各自的收益:
+  sync              原有配置 (同步写文件与 stderr)
+  sync+sample       只开启高频调试日志采样
+  async(rate=1)     只开启后台线程写入 (plugins/logging_setup.py 的 BackgroundFileSink / BackgroundConsoleSink，
+                    未使用 loguru 的 enqueue) 并关闭 diagnose，采样率为 1
+  async             实际的 async 模式 (后台写入 + 采样，采样率取 QQBOT_LOG_SAMPLE_RATE，默认 10)
+控制台输出重定向到 /dev/null (文件描述符级别，仍是真实的写调用)，结果打印到 stdout。
+
+模拟 bot.py 中每条群消息在事件循环线程上产生的日志 (事件到达的调试行 + 插件处理与 LLM 调用的 INFO 行)，
+分别统计调用方线程上的耗时 (即阻塞事件循环的时间) 与全部日志真正写完的耗时。
+
+用法:
+    python tools/bench_logging.py [消息条数]
+"""
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT_DIR)
+
+from loguru import logger  # noqa: E402
+
+from plugins.logging_setup import configure_logging, sampled_logger, LOG_MODE_SYNC, LOG_MODE_ASYNC  # noqa: E402
+
+
+def _emit_message_logs(i: int, raw_message: str) -> None:
+    """一条群消息对应的日志：采样的事件行 + 少量 INFO 行 (约每 5 条消息有 1 条@机器人)"""
+    sampled_logger.debug(
+        "--- [NcatBot EVENT] Group message received --- GroupID={}, UserID={}, RawMessage='{}'",
+        lambda: 100000 + i % 7, lambda: 200000 + i, lambda: raw_message[:200])
+    if i % 5 == 0:
+        logger.info("[process_message_content] 用户 group_{} | 消息: '{}...'", 100000 + i % 7, raw_message[:100])
+        logger.info("非流式 (第一次尝试) 完成 模型: {}. 结束原因: '{}', 是否有工具调用对象: {}, 内容长度: {}",
+                    "glm-4-flash", "stop", False, 321)
+
+
+def run(label: str, mode: str, sample_rate: int, count: int, logs_dir: str) -> float:
+    configure_logging(logs_dir, mode=mode, console=True)
+    sampled_logger.rate = sample_rate  # 覆盖模式默认值，以便单独测量采样与后台写入
+    raw_message = "这是一条用于基准测试的群消息 [CQ:image,file=abc.jpg] " * 4
+    start = time.perf_counter()
+    for i in range(count):
+        _emit_message_logs(i, raw_message)
+    caller_elapsed = time.perf_counter() - start
+    logger.complete()
+    logger.remove()  # 关闭处理器，async 模式下会等待后台写入线程写完队列
+    total_elapsed = time.perf_counter() - start
+    print(f"{label:<14}: 调用方耗时 {caller_elapsed * 1000:8.1f} ms ({count / caller_elapsed:10.0f} 条消息/秒), "
+          f"全部写完 {total_elapsed * 1000:8.1f} ms")
+    return caller_elapsed
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    os.environ.setdefault("QQBOT_LOG_LEVEL", "DEBUG")  # 让采样的调试行也参与对比
+    sample_rate = max(1, int(os.getenv("QQBOT_LOG_SAMPLE_RATE", "10")))
+    print(f"模拟 {count} 条群消息 (文件 + 控制台, QQBOT_LOG_LEVEL={os.environ['QQBOT_LOG_LEVEL']}, "
+          f"QQBOT_LOG_SAMPLE_RATE={sample_rate})")
+    # 控制台输出在文件描述符级别重定向到 /dev/null，loguru 仍对 sys.stderr 做真实的写调用
+    sys.stdout.flush()
+    saved_stderr = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 2)
+    results = {}
+    try:
+        for label, mode, rate in (("sync", LOG_MODE_SYNC, 1), ("sync+sample", LOG_MODE_SYNC, sample_rate),
+                                  ("async(rate=1)", LOG_MODE_ASYNC, 1), ("async", LOG_MODE_ASYNC, sample_rate)):
+            with tempfile.TemporaryDirectory() as logs_dir:
+                results[label] = run(label, mode, rate, count, logs_dir)
+                sys.stdout.flush()
+    finally:
+        os.dup2(saved_stderr, 2)
+        os.close(devnull)
+        os.close(saved_stderr)
+    base = results["sync"]
+    print(f"调用方耗时相对 sync: 采样 {base / results['sync+sample']:.2f}x, "
+          f"后台写入 {base / results['async(rate=1)']:.2f}x, 两者结合 {base / results['async']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
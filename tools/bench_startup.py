@@ -0,0 +1,72 @@
+"""
+启动开销基准测试：基于 `python -X importtime` 统计导入 plugins.llm_api 的耗时与峰值内存。
+
+对比两种情况:
+  lazy  - 只导入 plugins.llm_api (当前行为，SDK 在首次调用时才导入)
+  eager - 同时导入 openai / anthropic / zhipuai (相当于改造前在模块顶层导入全部 SDK)
+未安装的 SDK 会被跳过并在输出中注明。
+
+用法:
+    python tools/bench_startup.py [重复次数]
+"""
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK_MODULES = ("openai", "anthropic", "zhipuai")
+
+# 子进程中执行：导入目标模块后输出峰值 RSS (KB，Linux 下 ru_maxrss 单位为 KB)
+_CHILD_TEMPLATE = """
+import importlib, resource
+for name in {modules!r}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+print("MAXRSS_KB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _run_once(modules: List[str]) -> Tuple[int, int, Dict[str, int]]:
+    """返回 (所有顶层导入的累计耗时 us, 峰值 RSS KB, 各顶层模块累计耗时)"""
+    code = _CHILD_TEMPLATE.format(modules=modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=PROJECT_ROOT_DIR,
+                          capture_output=True, text=True, check=True)
+    top_level: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        # 缩进为 1 个空格的行是顶层导入，其累计耗时已包含全部子依赖
+        if match and len(match.group(3)) == 1:
+            top_level[match.group(4)] = top_level.get(match.group(4), 0) + int(match.group(2))
+    maxrss = int(re.search(r"MAXRSS_KB (\d+)", proc.stdout).group(1))
+    return sum(top_level.values()), maxrss, top_level
+
+
+def _bench(label: str, modules: List[str], repeat: int) -> None:
+    runs = [_run_once(modules) for _ in range(repeat)]
+    best_us = min(r[0] for r in runs)
+    best_rss = min(r[1] for r in runs)
+    slowest = sorted(runs[0][2].items(), key=lambda kv: kv[1], reverse=True)[:5]
+    print(f"{label:>5}: 导入耗时 {best_us / 1000:8.1f} ms, 峰值 RSS {best_rss / 1024:6.1f} MB  (最佳 / {repeat} 次)")
+    print("       最慢的顶层导入: " + ", ".join(f"{name} {us / 1000:.1f}ms" for name, us in slowest))
+
+
+def main() -> None:
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    installed = [m for m in SDK_MODULES if subprocess.run(
+        [sys.executable, "-c", f"import importlib.util, sys; sys.exit(importlib.util.find_spec({m!r}) is None)"]
+    ).returncode == 0]
+    missing = [m for m in SDK_MODULES if m not in installed]
+    if missing:
+        print(f"注意: 以下 SDK 未安装，eager 结果中不包含它们: {', '.join(missing)}")
+    _bench("lazy", ["plugins.llm_api"], repeat)
+    _bench("eager", ["plugins.llm_api"] + installed, repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+批量导出聊天历史 (活跃会话 + 归档包) 为 JSON Lines，供离线分析使用。
+逐个会话流式读取与写出，内存占用与会话总数无关；可以在机器人运行时执行。
+
+每行一个会话: {"session_id", "last_active", "archived", "messages": [...]}
+
+用法:
+    python tools/export_chat_history.py [-o data/exports/chat_history.jsonl.gz] [--days 30]
+                                        [--prefix group_] [--no-archived] [--history-dir data/chat_history]
+    -o - 表示输出到标准输出 (不压缩)，便于接管道处理
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from plugins.history_retention import iter_sessions, export_sessions  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="批量导出聊天历史")
+    parser.add_argument("-o", "--output", default=os.path.join(
+        PROJECT_ROOT, "data", "exports", f"chat_history-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz"),
+        help="输出文件，.gz 结尾时压缩；- 表示标准输出")
+    parser.add_argument("--history-dir", default=os.path.join(PROJECT_ROOT, "data", "chat_history"))
+    parser.add_argument("--days", type=float, default=0, help="只导出最近若干天活跃过的会话，默认全部")
+    parser.add_argument("--prefix", default="", help="只导出指定前缀的会话，如 group_ 或 private_")
+    parser.add_argument("--no-archived", action="store_true", help="不包含归档包中的会话")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 86400 if args.days > 0 else None
+    include_archived = not args.no_archived
+    if args.output == "-":
+        count = 0
+        for record in iter_sessions(args.history_dir, include_archived, since, args.prefix):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+    else:
+        count = export_sessions(args.history_dir, args.output, include_archived, since, args.prefix)
+        print(f"已导出 {count} 个会话到 {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+回放 plugins/traffic_recorder.py 录制的线上流量，用于对比不同版本机器人的吞吐量与延迟。
+
+消息事件按录制时的时间间隔 (可用 --speed 加速) 送入 bot.py 的 handle_group_message / handle_private_message，
+走与线上相同的调度、知识库、路由与会话逻辑；LLM 由名为 "replay" 的桩提供商代替，
+按会话依次复现录制到的调用耗时与 token 用量，不产生任何真实 API 调用。
+会话、用量统计、知识库与导出文件都写入临时目录，不会影响 data/ 中的线上数据：
+知识库在回放开始前复制一份到临时目录，录制中的管理员知识库命令只修改这份副本。
+录制时未保存原文 (默认) 的消息会用等长的占位文本代替，因此依赖文本内容的分支 (知识库、路由、联网判断) 与线上可能不同。
+
+用法:
+    python tools/replay_traffic.py data/recordings/traffic-xxx.jsonl.gz [--speed 10] [--llm-speed 1]
+                                   [--json result.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from loguru import logger  # noqa: E402
+
+PLACEHOLDER_TEXT = "这是一条用于流量回放的占位消息内容"
+
+
+def _placeholder(length: int) -> str:
+    return (PLACEHOLDER_TEXT * (length // len(PLACEHOLDER_TEXT) + 1))[:length]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _prepare_environment(work_dir: str) -> None:
+    # 必须在导入任何 plugins 模块之前设置：各模块在导入时读取配置，bot.py 加载 .env 时也不会覆盖已存在的环境变量。
+    # 会话历史目录也要在导入前指向临时目录，plugins/qq_bot.py 导入时就会加载会话并写入索引
+    os.environ["QQBOT_CHAT_HISTORY_DIR"] = os.path.join(work_dir, "chat_history")
+    # 录制中的管理员命令 (知识库添加/删除、导出历史) 会以管理员身份回放，知识库与导出目录同样指向临时目录；
+    # 知识库复制一份线上内容，使检索结果与线上一致
+    kb_dir = os.path.join(work_dir, "knowledge_base")
+    source_kb_dir = os.getenv("QQBOT_KB_DIR") or os.path.join(PROJECT_ROOT, "data", "knowledge_base")
+    if os.path.isdir(source_kb_dir):
+        shutil.copytree(source_kb_dir, kb_dir)
+    os.environ["QQBOT_KB_DIR"] = kb_dir
+    os.environ["QQBOT_EXPORT_DIR"] = os.path.join(work_dir, "exports")
+    os.environ["QQBOT_RECORD_TRAFFIC"] = "false"
+    os.environ["LLM_PROVIDER"] = "replay"
+    os.environ["ROOT"] = "1"  # 与 plugins.traffic_recorder.REPLAY_ADMIN_ID 一致
+    os.environ.setdefault("BT_UIN", "10000")
+    logger.remove()
+    logger.add(sys.stderr, level=os.getenv("REPLAY_LOG_LEVEL", "WARNING"))
+
+
+class _ReplayMessage:
+    """模拟 NcatBot 的 GroupMessage / PrivateMessage，只实现 bot.py 处理器用到的属性与方法"""
+
+    def __init__(self, event: Dict[str, Any], text: str):
+        self.user_id = event["user"]
+        self.group_id = event["target"]
+        self.text = text
+        self.raw_message = text
+        self._at_me = event.get("at_me", True)
+        self.replied = False
+
+    def is_at_me(self) -> bool:
+        return self._at_me
+
+    async def reply(self, text: Optional[str] = None, rtf: Any = None) -> None:
+        self.replied = True
+
+
+class _ReplayApi:
+    async def post_private_msg(self, user_id: Any, text: str) -> None:
+        pass
+
+
+class _ReplayBot:
+    api = _ReplayApi()
+
+
+def _register_replay_adapter(llm_events: List[Dict[str, Any]], llm_speed: float) -> None:
+    from plugins.llm_api import ProviderAdapter, register_provider
+    from plugins.usage_stats import usage_recorder
+
+    latencies = [e["latency_ms"] for e in llm_events] or [1000]
+    fallback = {"latency_ms": int(statistics.median(latencies)), "prompt_tokens": 0, "completion_tokens": 20,
+                "cached_tokens": 0, "web_search": False}
+
+    @register_provider
+    class ReplayAdapter(ProviderAdapter):
+        """按会话依次复现录制到的 LLM 调用耗时与用量；录制中没有对应调用时使用耗时中位数"""
+        name = "replay"
+        display_name = "流量回放桩"
+        sdk_module = "json"
+        model_env = "REPLAY_MODEL"
+        default_model_fallback = "replay"
+
+        def __init__(self):
+            self.queues: Dict[str, Deque[Dict[str, Any]]] = {}
+            for event in llm_events:
+                self.queues.setdefault(event.get("session") or "unknown", deque()).append(event)
+            self.calls = 0
+            self.fallback_calls = 0
+
+        async def generate(self, messages, model, temperature, max_tokens, enable_web_search, session_id=None):
+            queue = self.queues.get(session_id or "unknown")
+            recorded = queue.popleft() if queue else None
+            self.calls += 1
+            if recorded is None:
+                self.fallback_calls += 1
+                recorded = fallback
+            started_at = time.monotonic()
+            await asyncio.sleep(recorded["latency_ms"] / 1000 / llm_speed)
+            usage_recorder.record(self.name, model, session_id, prompt_tokens=recorded["prompt_tokens"],
+                                  completion_tokens=recorded["completion_tokens"],
+                                  cached_tokens=recorded["cached_tokens"],
+                                  latency_ms=int((time.monotonic() - started_at) * 1000),
+                                  web_search=recorded["web_search"])
+            return "回" * max(1, min(recorded["completion_tokens"], 500))
+
+
+async def replay(path: str, work_dir: str, speed: float, llm_speed: float) -> Dict[str, Any]:
+    from plugins.traffic_recorder import load_recording
+
+    events = load_recording(path)
+    message_events = [e for e in events if e["type"] == "message"]
+    llm_events = [e for e in events if e["type"] == "llm"]
+
+    _register_replay_adapter(llm_events, llm_speed)
+    import bot as bot_module
+    from plugins import qq_bot
+    from plugins.llm_api import get_provider
+    from plugins.lifecycle import lifecycle
+    from plugins.scheduler import priority_class_for
+    from plugins.usage_stats import usage_recorder
+
+    from plugins.knowledge_base import knowledge_base
+
+    # 会话历史、知识库与导出目录已在导入前指向临时目录 (见 _prepare_environment)，用量统计同样写到临时目录
+    for label, directory in (("会话历史", qq_bot.CHAT_HISTORY_DIR), ("知识库", knowledge_base.kb_dir),
+                             ("导出", qq_bot.EXPORT_DIR)):
+        if not directory.startswith(work_dir):
+            raise RuntimeError(f"{label}目录 {directory} 未被重定向到临时目录，拒绝回放以免写入线上数据")
+    usage_recorder.db_path = os.path.join(work_dir, "usage_stats.db")
+    bot_module.bot = _ReplayBot()
+
+    latencies: Dict[str, List[float]] = {}
+    handled = 0
+
+    async def run_one(event: Dict[str, Any]) -> None:
+        nonlocal handled
+        text = event.get("text") or _placeholder(event.get("len", 0))
+        msg = _ReplayMessage(event, text)
+        if event["kind"] == "group":
+            session_id = f"group_{event['target']}"
+            handler = bot_module.handle_group_message
+        else:
+            session_id = f"private_{event['target']}"
+            handler = bot_module.handle_private_message
+        started_at = time.monotonic()
+        async with lifecycle.track():
+            await handler(msg)
+        # 只统计会进入插件处理的消息 (群@ 与非空私聊)，其余消息只贡献事件负载
+        if text and (event["kind"] == "private" or event.get("at_me", True)):
+            handled += 1
+            latency = time.monotonic() - started_at
+            latencies.setdefault(priority_class_for(session_id, str(event["user"])), []).append(latency)
+
+    print(f"回放 {path}: {len(message_events)} 条消息事件, {len(llm_events)} 次录制的 LLM 调用, "
+          f"速度 {speed}x (LLM 耗时 {llm_speed}x)")
+    loop = asyncio.get_running_loop()
+    replay_started = loop.time()
+    tasks = []
+    for event in message_events:
+        delay = replay_started + event["t"] / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(run_one(event)))
+    await asyncio.gather(*tasks)
+    wall_seconds = loop.time() - replay_started
+
+    adapter = get_provider("replay")
+    all_latencies = [v for values in latencies.values() for v in values]
+    result: Dict[str, Any] = {
+        "recording": os.path.basename(path),
+        "speed": speed,
+        "llm_speed": llm_speed,
+        "events": len(message_events),
+        "handled": handled,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_second": round(handled / wall_seconds, 2) if wall_seconds else 0.0,
+        "llm_calls": adapter.calls if adapter else 0,
+        "llm_fallback_calls": adapter.fallback_calls if adapter else 0,
+        "latency_ms": {},
+    }
+    for name, values in [("all", all_latencies)] + sorted(latencies.items()):
+        result["latency_ms"][name] = {
+            "count": len(values),
+            "p50": round(_percentile(values, 50) * 1000, 1),
+            "p95": round(_percentile(values, 95) * 1000, 1),
+            "p99": round(_percentile(values, 99) * 1000, 1),
+            "max": round(max(values) * 1000, 1) if values else 0.0,
+        }
+    return result
+
+
+def _print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    def delta(current: float, previous: Optional[float]) -> str:
+        if previous in (None, 0):
+            return ""
+        return f" ({(current - previous) / previous:+.1%})"
+
+    base_latency = (baseline or {}).get("latency_ms", {})
+    print(f"处理 {result['handled']} / {result['events']} 条消息, 用时 {result['wall_seconds']} 秒, "
+          f"吞吐 {result['throughput_per_second']} 条/秒"
+          f"{delta(result['throughput_per_second'], (baseline or {}).get('throughput_per_second'))}")
+    print(f"LLM 调用 {result['llm_calls']} 次 (无对应录制、使用中位数耗时 {result['llm_fallback_calls']} 次)")
+    print(f"{'类别':<8}{'数量':>6}{'p50(ms)':>16}{'p95(ms)':>16}{'p99(ms)':>16}{'max(ms)':>16}")
+    for name, row in result["latency_ms"].items():
+        base = base_latency.get(name, {})
+        cells = "".join(f"{str(row[k]) + delta(row[k], base.get(k)):>16}" for k in ("p50", "p95", "p99", "max"))
+        print(f"{name:<8}{row['count']:>6}{cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回放录制的线上流量")
+    parser.add_argument("recording", help="录制文件 (data/recordings/traffic-*.jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="消息到达的回放倍速，默认 1 (按录制时间间隔)")
+    parser.add_argument("--llm-speed", type=float, default=1.0, help="LLM 耗时的缩放倍速，默认 1 (按录制耗时)")
+    parser.add_argument("--json", dest="json_path", help="把结果写入 JSON 文件，供之后 --compare 使用")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比，显示变化百分比")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="qchat-replay-")
+    _prepare_environment(work_dir)
+    result = asyncio.run(replay(args.recording, work_dir, max(args.speed, 0.001), max(args.llm_speed, 0.001)))
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_result(result, baseline)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
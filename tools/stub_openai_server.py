@@ -0,0 +1,106 @@
+"""
+本地 OpenAI 兼容桩服务器，用于在没有真实推理服务时测试 openai_compat 提供商 (包括微批处理模式)。
+
+支持:
+  POST /v1/chat/completions  回显最后一条用户消息
+  POST /v1/completions       prompt 可为字符串或列表 (批量)，每个 prompt 返回一个 choice
+  GET  /v1/models
+每个请求都会在 stderr 打印批大小与请求头，便于确认批处理与自定义请求头是否生效。
+
+用法:
+    python tools/stub_openai_server.py [--port 8000] [--latency-ms 200]
+    然后在 .env 中设置 LLM_PROVIDER=openai_compat 与 OPENAI_COMPAT_BASE_URL=http://127.0.0.1:8000/v1
+"""
+import argparse
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+def _usage(prompt_chars: int, completion_chars: int) -> Dict[str, int]:
+    # 桩服务器按字符数近似 token 数
+    return {"prompt_tokens": prompt_chars, "completion_tokens": completion_chars,
+            "total_tokens": prompt_chars + completion_chars}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0.0
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", "0"))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        extra_headers = {k: v for k, v in self.headers.items()
+                         if k.lower().startswith("x-") and not k.lower().startswith("x-stainless")}
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            last_user = next((m["content"] for m in reversed(request.get("messages", []))
+                              if m.get("role") == "user"), "")
+            reply = f"[stub:{request.get('model')}] {last_user}"
+            sys.stderr.write(f"chat/completions model={request.get('model')} headers={extra_headers}\n")
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": "stop"}],
+                "usage": _usage(sum(len(m.get("content", "")) for m in request.get("messages", [])), len(reply)),
+            })
+        elif self.path.rstrip("/").endswith("/completions"):
+            prompts = request.get("prompt", "")
+            if isinstance(prompts, str):
+                prompts = [prompts]
+            sys.stderr.write(f"completions model={request.get('model')} batch={len(prompts)} headers={extra_headers}\n")
+            choices = []
+            for i, prompt in enumerate(prompts):
+                # 取 ChatML 中最后一条 user 消息作为回显内容
+                tail = prompt.rsplit("<|im_start|>user\n", 1)[-1].split("<|im_end|>", 1)[0]
+                choices.append({"index": i, "text": f"[stub:{request.get('model')}#{i}] {tail}",
+                                "finish_reason": "stop", "logprobs": None})
+            self._send_json(200, {
+                "id": "cmpl-stub", "object": "text_completion", "created": int(time.time()),
+                "model": request.get("model"), "choices": choices,
+                "usage": _usage(sum(len(p) for p in prompts), sum(len(c["text"]) for c in choices)),
+            })
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # 请求信息已在 do_POST 中输出
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容桩服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求模拟的推理耗时")
+    args = parser.parse_args()
+    StubHandler.latency_seconds = args.latency_ms / 1000
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"OpenAI 兼容桩服务器已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()